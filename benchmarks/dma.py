@@ -0,0 +1,82 @@
+'''Time writing DMA control blocks for a job's pulses: the block by block loop DMAGPIO
+used, against controlblocks' numpy batches, in MB/s of control blocks
+
+    python -m benchmarks.dma'''
+import mmap
+import random
+import struct
+import time
+from drawpi.hardware.controlblocks import CONTROL_BLOCK_SIZE, NEXT_WORD, control_blocks
+from drawpi.hardware.stepgen import direction_masks, line_masks, pulse_blocks
+
+LINES = 2000
+MAX_STEPS = 2000
+DELAY = 800
+# A full DMAGPIO buffer
+BLOCK_NUMBER = 983040
+BUS_ADDRESS = 0xC0000000
+
+# Stand-ins for DMAGPIO's words, which need the Pi's registers
+PULSE = (0x400000A, 0x7E20001C, 0x20004, 0xC0004)
+DELAY_WORDS = (0x4050848, 0x7E20C018, 0)
+
+
+def job_blocks():
+    rand = random.Random(1)
+    blocks = []
+    while len(blocks) < BLOCK_NUMBER:
+        dx, dy = rand.randrange(MAX_STEPS), rand.randrange(MAX_STEPS)
+        set_mask, clear_mask = direction_masks(rand.random() < 0.5, rand.random() < 0.5)
+        blocks.append((set_mask, clear_mask))
+        blocks.extend(pulse_blocks(line_masks(dx, dy), DELAY))
+    return blocks[:BLOCK_NUMBER]
+
+
+def words(p):
+    if len(p) == 2:
+        return (PULSE[0], 0, PULSE[1], PULSE[2], PULSE[3], 0, p[0], p[1])
+    return (DELAY_WORDS[0], 0, DELAY_WORDS[1], p[0] << 4, DELAY_WORDS[2], 0, 0, 0)
+
+
+def loop_insert(blocks, memory):
+    '''As DMAGPIO._insert_blocks wrote them, one struct.pack_into per block'''
+    current_address = 0
+    for p in blocks:
+        next1 = current_address + CONTROL_BLOCK_SIZE + BUS_ADDRESS
+        source = next1 - 8
+        if len(p) > 1:
+            data = (PULSE[0], source, PULSE[1], PULSE[2], PULSE[3], next1, p[0], p[1])
+        else:
+            data = (DELAY_WORDS[0], source, DELAY_WORDS[1], p[0] << 4, DELAY_WORDS[2], next1, 0, 0)
+        struct.pack_into("8I", memory, current_address, *data)
+        current_address += CONTROL_BLOCK_SIZE
+    struct.pack_into("I", memory, current_address + 20 - CONTROL_BLOCK_SIZE, 0)
+
+
+def bulk_insert(blocks, memory):
+    data = control_blocks(blocks, words, BUS_ADDRESS)
+    data[-1, NEXT_WORD] = 0
+    data = memoryview(data).cast('B')
+    memory[0:len(data)] = data
+
+
+def bench(name, insert, blocks, memory):
+    start = time.perf_counter()
+    insert(blocks, memory)
+    taken = time.perf_counter() - start
+    size = len(blocks) * CONTROL_BLOCK_SIZE / 1048576
+    print("{:<6} {:>8} blocks {:7.2f}s {:8.1f} MB/s".format(name, len(blocks), taken, size / taken))
+
+
+def main():
+    blocks = job_blocks()
+    loop_memory = mmap.mmap(-1, BLOCK_NUMBER * CONTROL_BLOCK_SIZE)
+    bulk_memory = mmap.mmap(-1, BLOCK_NUMBER * CONTROL_BLOCK_SIZE)
+    bench("loop", loop_insert, blocks, loop_memory)
+    bench("bulk", bulk_insert, blocks, bulk_memory)
+    # Same control blocks
+    assert loop_memory[:] == bulk_memory[:]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+'''Time parsing a large JCode file: the recursive parser PlotterParser replaced, against
+PlotterParser and decode_array
+
+    python -m benchmarks.parse [FILE]
+
+Without a file, a million lines of random strokes are generated.'''
+import random
+import sys
+import tempfile
+import time
+from drawpi import config
+from drawpi.decode import ParseError, PlotterParser, decode_array
+from drawpi.point import Point
+
+LINES = 1000000
+STROKE = 40
+
+
+def generate(f, lines=LINES):
+    '''Write lines of JCode, strokes of STROKE lines each'''
+    rand = random.Random(1)
+    f.write("SP 20\n")
+    written = 1
+    while written < lines:
+        f.write("GT %.4f %.4f\nPD\n" % (rand.uniform(0, 200), rand.uniform(0, 200)))
+        f.write("".join("LN %.4f %.4f\n" % (rand.uniform(0, 200), rand.uniform(0, 200))
+                        for _ in range(STROKE)))
+        f.write("PU\n\n")
+        written += STROKE + 4
+
+
+class RecursiveParser:
+    '''PlotterParser as it was before it was made iterative: dict commands, handlers
+    looked up by list index, and a recursive call for every line without a command.
+    Points are made the current way, so only the parsing itself is compared.'''
+    COMMANDS = ["SP", "ZE", "PU", "PD", "LN", "GT"]
+
+    def __init__(self, commands):
+        self.text = commands
+        # A copy, so the benchmark doesn't change the defaults
+        self.settings = dict(config.DEFAULTS)
+        self.line = 0
+        self.COMMAND_PARSERS = [
+            self.parse_feedrate,
+            self.parse_gotozero,
+            self.parse_penup,
+            self.parse_pendown,
+            self.parse_line,
+            self.parse_goto
+        ]
+        self.begin_parsing()
+
+    def parse_error(self, message):
+        raise ParseError("Line {}: {}".format(self.line, message))
+
+    def parse_feedrate(self, command):
+        if not len(command) == 2:
+            self.parse_error("SP must specify one feedrate.")
+        else:
+            try:
+                self.settings["feedrate"] = int(command[1])
+            except ValueError:
+                self.parse_error("Invalid feedrate value.")
+        return 0
+
+    def parse_line(self, command):
+        if len(command) == 3:
+            try:
+                return {
+                    "type": "line",
+                    "finish": Point(float(command[1]), float(command[2])),
+                    "feedrate": self.settings["feedrate"]
+                }
+            except ValueError:
+                self.parse_error("Invalid Coordinate Values")
+        else:
+            self.parse_error("LN must specify end coords.")
+
+    def parse_goto(self, command):
+        if len(command) == 3:
+            try:
+                return {
+                    "type": "goto",
+                    "finish": Point(float(command[1]), float(command[2]))
+                }
+            except ValueError:
+                self.parse_error("Invalid Coordinate Values")
+        else:
+            self.parse_error("GT must specify end coords.")
+
+    def parse_gotozero(self, command):
+        if len(command) == 1:
+            return {"type": "zero"}
+        self.parse_error("Invalid ZE command.")
+
+    def parse_pendown(self, command):
+        if len(command) == 1:
+            return {"type": "pen", "state": True}
+        self.parse_error("Invalid PD command.")
+
+    def parse_penup(self, command):
+        if len(command) == 1:
+            return {"type": "pen", "state": False}
+        self.parse_error("Invalid PU command.")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def next(self):
+        command = next(self.commands).strip().split()
+        self.line += 1
+        if len(command):
+            if not command[0] in self.COMMANDS:
+                raise ParseError("Not a valid command at line {}".format(self.line))
+            com = self.COMMAND_PARSERS[self.COMMANDS.index(command[0])](command)
+            if com:
+                return com
+            return self.next()
+        return self.next()
+
+    def begin_parsing(self):
+        if isinstance(self.text, str):
+            self.commands = iter(self.text.split('\n'))
+        else:
+            self.commands = iter(self.text)
+
+
+def bench(name, parse, path):
+    start = time.perf_counter()
+    count = parse(path)
+    taken = time.perf_counter() - start
+    print("{:<16} {:>9} commands {:7.2f}s {:>12,.0f} commands/min".format(
+        name, count, taken, count / taken * 60))
+
+
+def recursive_commands(path):
+    with open(path) as f:
+        return sum(1 for _ in RecursiveParser(f))
+
+
+def parser_commands(path):
+    with open(path) as f:
+        return sum(1 for _ in PlotterParser(f))
+
+
+def array_commands(path):
+    with open(path, 'rb') as f:
+        return len(decode_array(f.read()))
+
+
+def main(path):
+    bench("RecursiveParser", recursive_commands, path)
+    bench("PlotterParser", parser_commands, path)
+    bench("decode_array", array_commands, path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.NamedTemporaryFile('w', suffix=".jc") as f:
+            generate(f)
+            f.flush()
+            main(f.name)
@@ -0,0 +1,342 @@
+'''Check DMAGPIO's ring of control blocks against fake registers: a DMA that follows
+the chain of blocks in memory as the real one does, loading each block's next address
+as it starts it. Drives update() through wrapping round, running dry(underruns),
+draining and the races linking on more blocks, checking the blocks run are the ones
+added, in order, and what the ring counted.
+
+    python -m benchmarks.ring'''
+import builtins
+import logging
+import random
+import time
+from unittest import mock
+
+CPUINFO = "Hardware\t: BCM2835\nRevision\t: a02082\n"
+BUS_ADDRESS = 0xC0000000
+
+
+def _open(path, *args, **kwargs):
+    if path == "/proc/cpuinfo":
+        return mock.mock_open(read_data=CPUINFO)()
+    return _real_open(path, *args, **kwargs)
+
+
+# The register module looks for a Pi when imported
+_real_open = builtins.open
+with mock.patch("builtins.open", _open):
+    from drawpi.hardware.hardware_internals import rpgpio, rpgpio_private as regs
+from drawpi.hardware.feeder import DMAFeeder
+
+
+class FakePage(regs.PhysicalMemory):
+    '''Registers(or memory), as plain bytes'''
+
+    def __init__(self, phys_address=0, size=regs.PAGE_SIZE):
+        self._size = size
+        self._memmap = bytearray(size)
+
+
+class FakeBuffer(FakePage):
+    '''The CMA buffer of control blocks. on_write is called when a single word is
+    written(redirecting the end of the chain), to make the DMA move at that moment.'''
+    on_write = None
+
+    def __init__(self, size):
+        super().__init__(0, size)
+
+    def write_int(self, address, int_value):
+        super().write_int(address, int_value)
+        if self.on_write is not None:
+            self.on_write()
+
+    def get_bus_address(self):
+        return BUS_ADDRESS
+
+
+class FakeDMA(FakePage):
+    '''The DMA registers. Only the channel DMAGPIO uses runs, a block at a time, by step.
+    The blocks it has run are decoded into run.
+
+    Clearing ACTIVE part way through a chain pauses it(setting PAUSED), and setting it
+    again carries on with the block it had loaded. NEXTCONBK may only be written while
+    it isn't active. on_pause is called when asked to pause, before it does, to make the
+    DMA move at that moment.'''
+    on_pause = None
+
+    def __init__(self, phys_address=0, size=regs.PAGE_SIZE):
+        super().__init__(phys_address, size)
+        self.channel = 0x100 * rpgpio.DMAGPIO._DMA_CHANNEL
+        self.buffer = None
+        self.run = []
+        # Whether the block at CONBLK_AD has been loaded(so is paused, if not active)
+        self.loaded = False
+
+    def write_int(self, address, int_value):
+        if address == self.channel + regs.DMA_NEXTCONBK:
+            assert not self.active(), "NEXTCONBK written while the DMA is active"
+        elif address == self.channel + regs.DMA_CONBLK_AD:
+            self.loaded = False
+        elif address == self.channel + regs.DMA_CS and self.active() \
+                and not int_value & regs.DMA_CS_ACTIVE and self.on_pause is not None:
+            self.on_pause()
+        super().write_int(address, int_value)
+        if address == self.channel + regs.DMA_CS:
+            if int_value & (regs.DMA_CS_ABORT | regs.DMA_CS_RESET):
+                self._finish()
+            elif int_value & regs.DMA_CS_ACTIVE:
+                if not self.loaded:
+                    self._load(self.read_int(self.channel + regs.DMA_CONBLK_AD))
+                super().write_int(address, int_value & ~regs.DMA_CS_PAUSED)
+            elif self.loaded:
+                super().write_int(address, int_value | regs.DMA_CS_PAUSED)
+
+    def active(self):
+        return bool(self.read_int(self.channel + regs.DMA_CS) & regs.DMA_CS_ACTIVE)
+
+    def _load(self, bus_address):
+        # The next address is read when a block is started, later changes to it
+        # in memory aren't seen
+        super().write_int(self.channel + regs.DMA_CONBLK_AD, bus_address)
+        block = bus_address - BUS_ADDRESS
+        super().write_int(self.channel + regs.DMA_NEXTCONBK, self.buffer.read_int(block + 20))
+        self.loaded = True
+
+    def _finish(self):
+        cs = self.read_int(self.channel + regs.DMA_CS)
+        cs &= ~(regs.DMA_CS_ACTIVE | regs.DMA_CS_PAUSED)
+        super().write_int(self.channel + regs.DMA_CS, cs | regs.DMA_CS_END)
+        super().write_int(self.channel + regs.DMA_CONBLK_AD, 0)
+        self.loaded = False
+
+    def step(self, number=1):
+        '''Run up to number blocks, returning how many were'''
+        for done in range(number):
+            if not self.active():
+                return done
+            self.run.append(self._decode(self.read_int(self.channel + regs.DMA_CONBLK_AD)))
+            following = self.read_int(self.channel + regs.DMA_NEXTCONBK)
+            if following == 0:
+                self._finish()
+            else:
+                self._load(following)
+        return number
+
+    def step_to(self, block):
+        '''Run up to(not including) the block at offset block'''
+        while self.active() and self.read_int(self.channel + regs.DMA_CONBLK_AD) != BUS_ADDRESS + block:
+            self.step()
+
+    def _decode(self, bus_address):
+        block = bus_address - BUS_ADDRESS
+        words = [self.buffer.read_int(block + 4 * i) for i in range(8)]
+        # The data is kept in the block's own padding
+        assert words[1] == bus_address + 24, "source isn't the block's padding"
+        if words[2] == regs.PHYSICAL_GPIO_BUS + regs.GPIO_SET_OFFSET:
+            return (words[6], words[7])
+        elif words[2] == regs.PHYSICAL_PWM_BUS + regs.PWM_FIFO:
+            return (words[3] >> 4,)
+        return ("servo", words[6] // 100)
+
+
+def expected(blocks):
+    '''blocks, as FakeDMA decodes them'''
+    return [("servo", b[2]) if len(b) == 3 else b for b in blocks]
+
+
+class SmallDMAGPIO(rpgpio.DMAGPIO):
+    # Small enough to wrap round often
+    _BLOCK_NUMBER = 64
+    _LOW_WATERMARK = 8
+    _HIGH_WATERMARK = 63
+
+
+def make_dma():
+    with mock.patch.object(regs, "CMAPhysicalMemory", FakeBuffer), \
+            mock.patch.object(regs, "PhysicalMemory", FakeDMA), \
+            mock.patch.object(rpgpio, "PhysicalMemory", FakePage):
+        dma = SmallDMAGPIO()
+    dma._dma.buffer = dma._phys_memory
+    return dma
+
+
+def random_blocks(rand, number):
+    blocks = []
+    for _ in range(number):
+        kind = rand.random()
+        if kind < 0.6:
+            blocks.append((rand.getrandbits(27), rand.getrandbits(27)))
+        elif kind < 0.98:
+            blocks.append((rand.randrange(1, 2000),))
+        else:
+            blocks.append(("servo", 18, rand.randrange(1000, 2000)))
+    return blocks
+
+
+def check_wrapping():
+    '''Refilled faster than it runs, it should never run dry'''
+    rand = random.Random(1)
+    dma = make_dma()
+    added = []
+    for _ in range(500):
+        blocks = random_blocks(rand, rand.randrange(0, 40))
+        added += blocks
+        dma.add_pulses(blocks)
+        dma.update()
+        assert dma.ring.level() <= dma.ring.high_watermark
+        # Never as far as the end of the chain
+        dma._dma.step(min(rand.randrange(0, 40), max(dma.ring.level() - 1, 0)))
+    while dma.blocks_queue or dma.is_active():
+        dma.update(drain=True)
+        dma._dma.step(10)
+    assert dma._dma.run == expected(added)
+    assert dma.ring.underruns == 0 and dma.ring.wraps > 10, dma.stats()
+    return dma.stats()
+
+
+def check_underruns():
+    '''Left to run dry without draining, each time is an underrun, and it restarts
+    where it left off. Run dry when draining, it isn't.'''
+    rand = random.Random(2)
+    dma = make_dma()
+    added = []
+    dry = 0
+    for i in range(200):
+        blocks = random_blocks(rand, rand.randrange(1, 100))
+        added += blocks
+        dma.add_pulses(blocks)
+        dma.update(drain=i % 3 == 0)
+        # Only draining once everything queued is in memory
+        flushed = i % 3 == 0 and not dma.blocks_queue
+        dma._dma.step(rand.randrange(0, 100))
+        if not dma._dma.active() and not flushed:
+            dry += 1
+    while dma.blocks_queue or dma.is_active():
+        dma.update(drain=True)
+        dma._dma.step(10)
+    assert dma._dma.run == expected(added)
+    assert dma.ring.underruns == dry, (dma.ring.underruns, dry)
+    assert dry > 0 and dma.ring.low_water > 0
+    return dma.stats()
+
+
+def check_next_race():
+    '''The DMA has loaded the last block of the chain, and its next address, when more
+    are linked on. Without NEXTCONBK being written too(paused), it would stop after it.'''
+    rand = random.Random(3)
+    dma = make_dma()
+    added = []
+    for _ in range(100):
+        blocks = random_blocks(rand, rand.randrange(1, 30))
+        added += blocks
+        dma.add_pulses(blocks)
+        dma.update()
+        dma._dma.step_to(dma.ring.last * dma.control_block_size())
+        assert dma._dma.active()
+    dma.update(drain=True)
+    while dma.is_active():
+        dma._dma.step(10)
+    assert dma._dma.run == expected(added)
+    assert dma.ring.underruns == 0, dma.stats()
+    return dma.stats()
+
+
+def check_finish_race():
+    '''The DMA finishes the chain between the new blocks being linked on and checking
+    it is still running, so is restarted at them'''
+    rand = random.Random(4)
+    dma = make_dma()
+    added = []
+    finished = 0
+    for _ in range(100):
+        blocks = random_blocks(rand, rand.randrange(1, 30))
+        added += blocks
+        dma.add_pulses(blocks)
+        if dma._dma.active():
+            dma._dma.step_to(dma.ring.last * dma.control_block_size())
+            # It runs its last block as the chain is redirected
+            dma._phys_memory.on_write = lambda: dma._dma.step()
+            finished += 1
+        dma.update()
+        dma._phys_memory.on_write = None
+        # Not running dry otherwise(the ring's level may count the block it ran)
+        dma._dma.step(min(rand.randrange(0, 20), len(blocks) - 1))
+    dma.update(drain=True)
+    while dma.is_active():
+        dma._dma.step(10)
+    assert dma._dma.run == expected(added)
+    assert dma.ring.underruns == finished, (dma.ring.underruns, finished)
+    return dma.stats()
+
+
+def check_pause_race():
+    '''The DMA finishes its last block as it is paused to write NEXTCONBK, so is
+    restarted at the new blocks instead'''
+    rand = random.Random(5)
+    dma = make_dma()
+    added = []
+    finished = 0
+    for _ in range(100):
+        blocks = random_blocks(rand, rand.randrange(1, 30))
+        added += blocks
+        dma.add_pulses(blocks)
+        if dma._dma.active():
+            dma._dma.step_to(dma.ring.last * dma.control_block_size())
+            dma._dma.on_pause = lambda: dma._dma.step()
+            finished += 1
+        dma.update()
+        dma._dma.on_pause = None
+        dma._dma.step(min(rand.randrange(0, 20), len(blocks) - 1))
+    dma.update(drain=True)
+    while dma.is_active():
+        dma._dma.step(10)
+    assert dma._dma.run == expected(added)
+    assert dma.ring.underruns == finished, (dma.ring.underruns, finished)
+    return dma.stats()
+
+
+def check_feeder_window():
+    '''DMAFeeder's thread has taken the blocks from the queue, but not started the DMA
+    on them yet. It is still active then, or waiting till it's idle would stop early.'''
+    rand = random.Random(6)
+    dma = make_dma()
+    feeder = DMAFeeder(dma)
+    seen = []
+    run = dma.run
+
+    def starting(address=0):
+        # Taken from the queue, the DMA not running yet
+        seen.append(feeder.is_active())
+        run(address)
+    dma.run = starting
+    added = []
+    try:
+        for _ in range(50):
+            blocks = random_blocks(rand, rand.randrange(1, 100))
+            added += blocks
+            feeder.add_pulses(blocks)
+            feeder.update(drain=True)
+            # As plotter.wait_till_idle does
+            while feeder.is_active():
+                with feeder.condition:
+                    dma._dma.step(rand.randrange(0, 20))
+                time.sleep(0.0001)
+            assert len(dma._dma.run) == len(added), "idle before its blocks ran"
+    finally:
+        feeder.close()
+    assert dma._dma.run == expected(added)
+    assert seen and all(seen), "inactive while starting"
+    return feeder.stats()
+
+
+def main():
+    # The underruns are meant to happen
+    logging.getLogger(rpgpio.__name__).setLevel(logging.ERROR)
+    for check in (check_wrapping, check_underruns, check_next_race, check_finish_race,
+                  check_pause_race, check_feeder_window):
+        stats = check()
+        print("{:<20} ok  inserted {inserted:>6} wraps {wraps:>5} underruns {underruns:>4} "
+              "low water {low_water:>5}".format(check.__name__, **stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''Time generating the pulses of lines: the step by step loop Plotter used, against
+stepgen's numpy version, unmerged and merged(config.MERGE_PULSES)
+
+    python -m benchmarks.steps'''
+import random
+import time
+from drawpi import config
+from drawpi.hardware.stepgen import line_masks, pulse_blocks
+
+LINES = 200
+MAX_STEPS = 20000
+DELAY = 800
+
+
+def loop_blocks(dx, dy, delay):
+    '''The blocks of a line, as Plotter._generate_line_pulses made them, step by step'''
+    blocks = []
+
+    def add_pulse(pulse):
+        blocks.append((pulse[0], pulse[1]))
+        blocks.append((pulse[2],))
+
+    def pulse_steppers(stepx, stepy, delay):
+        bitmask = 0
+        if stepx:
+            bitmask |= 1 << config.X_STEP
+        if stepy:
+            bitmask |= 1 << config.Y_STEP
+        add_pulse((bitmask, 0, int(delay / 2)))
+        add_pulse((0, bitmask, int((delay + 1) / 2)))
+
+    x = y = 0
+    fxy = dx - dy
+    while (x != dx) or (y != dy):
+        if fxy > 0:
+            pulse_steppers(True, False, delay)
+            x += 1
+            fxy -= dy
+        else:
+            pulse_steppers(False, True, delay)
+            y += 1
+            fxy += dx
+    return blocks
+
+
+def numpy_blocks(dx, dy, delay):
+    return pulse_blocks(line_masks(dx, dy), delay, merge=False)
+
+
+def merged_blocks(dx, dy, delay):
+    return pulse_blocks(line_masks(dx, dy), delay, merge=True)
+
+
+def rising_edges(blocks):
+    '''When(us) each step pin goes high, and which'''
+    edges = []
+    now = levels = 0
+    for block in blocks:
+        if len(block) == 1:
+            now += block[0]
+        else:
+            if block[0] & ~levels:
+                edges.append((now, block[0] & ~levels))
+            levels = (levels | block[0]) & ~block[1]
+    assert levels == 0
+    return edges
+
+
+def bench(name, generate, lines):
+    start = time.perf_counter()
+    steps = blocks = 0
+    for dx, dy in lines:
+        blocks += len(generate(dx, dy, DELAY))
+        steps += dx + dy
+    taken = time.perf_counter() - start
+    print("{:<8} {:>9} steps {:7.2f}s {:>12,.0f} steps/s {:5.2f} blocks/step".format(
+        name, steps, taken, steps / taken, blocks / steps))
+
+
+def main():
+    rand = random.Random(1)
+    lines = [(rand.randrange(MAX_STEPS), rand.randrange(MAX_STEPS)) for _ in range(LINES)]
+    # Same pulses
+    for dx, dy in lines[:20] + [(0, 5), (5, 0), (7, 7), (1, 1000), (1000, 1)]:
+        assert loop_blocks(dx, dy, DELAY) == numpy_blocks(dx, dy, DELAY), (dx, dy)
+        # Same timing
+        assert rising_edges(numpy_blocks(dx, dy, DELAY)) == rising_edges(merged_blocks(dx, dy, DELAY))
+    bench("loop", loop_blocks, lines)
+    bench("numpy", numpy_blocks, lines)
+    bench("merged", merged_blocks, lines)
+
+
+if __name__ == "__main__":
+    main()
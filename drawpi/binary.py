@@ -0,0 +1,147 @@
+'''Binary JCode: fixed size records of int32 (opcode, x steps, y steps, feedrate)
+
+The file is a header, then one record per command. Coordinates are in steps, so
+there is nothing to parse when drawing, and files are loaded through mmap.
+'''
+from array import array
+import mmap
+import struct
+import sys
+import drawpi.config as config
+import numpy as np
+from drawpi.decode import (COMMANDS, GT, LN, PD, PEN_DOWN, PEN_UP, PU, RECORD_DTYPE, SP, ZE,
+                           ZERO, Goto, Line, PlotterParser)
+from drawpi.point import Point
+from drawpi.utils import steps_to_mm
+
+MAGIC = b"JCB1"
+VERSION = 1
+# Magic, version, steps per mm the coordinates were made for
+HEADER = struct.Struct("<4sII")
+# Words per record, laid out as decode.RECORD_DTYPE
+RECORD_WORDS = 4
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+# Records are written a batch at a time
+WRITE_BATCH = 4096
+
+
+class BinaryFormatError(Exception):
+    '''Not a binary JCode file this plotter can draw'''
+    pass
+
+
+def write(commands, f):
+    '''Write parsed commands(see PlotterParser) to a binary file object, returning the
+    number of records written'''
+    f.write(HEADER.pack(MAGIC, VERSION, config.STEPS_MM))
+    records = array('i')
+    count = 0
+    feedrate = None
+    for command in commands:
+        kind = command.type
+        if kind == "line":
+            if command.feedrate != feedrate:
+                feedrate = command.feedrate
+                records.extend((SP, 0, 0, feedrate))
+            records.extend((LN, command.finish.x, command.finish.y, feedrate))
+        elif kind == "goto":
+            records.extend((GT, command.finish.x, command.finish.y, feedrate or 0))
+        elif kind == "pen":
+            records.extend((PD if command.state else PU, 0, 0, feedrate or 0))
+        elif kind == "zero":
+            records.extend((ZE, 0, 0, feedrate or 0))
+        if len(records) >= WRITE_BATCH * RECORD_WORDS:
+            count += _flush(records, f)
+            records = array('i')
+    return count + _flush(records, f)
+
+
+def _flush(records, f):
+    if sys.byteorder != "little":
+        records.byteswap()
+    records.tofile(f)
+    return len(records) // RECORD_WORDS
+
+
+class BinaryCommands:
+    '''Commands of a binary JCode file, mapped into memory. Iterating gives the same
+    commands PlotterParser would, straight from the records.'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise BinaryFormatError("Too short for a binary JCode file")
+        magic, version, steps_mm = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise BinaryFormatError("Not a version {} binary JCode file".format(VERSION))
+        if steps_mm != config.STEPS_MM:
+            raise BinaryFormatError("File is for {} steps/mm, plotter has {}".format(
+                steps_mm, config.STEPS_MM))
+        if (len(self.mmap) - HEADER.size) % RECORD_SIZE:
+            raise BinaryFormatError("File ends part way through a record")
+        if sys.byteorder != "little":
+            raise BinaryFormatError("Binary JCode can only be mapped on little endian machines")
+        # No copy, the words are read straight from the mapped file
+        self.words = memoryview(self.mmap)[HEADER.size:].cast('i')
+
+    def __len__(self):
+        return len(self.words) // RECORD_WORDS
+
+    def array(self):
+        '''The records as an array of decode.RECORD_DTYPE, without copying. Unlike
+        decode_array's, it has the SP records. Must be deleted before closing.'''
+        return np.frombuffer(self.mmap, dtype=RECORD_DTYPE, offset=HEADER.size)
+
+    def records(self):
+        '''(opcode, x, y, feedrate) of each record'''
+        words = self.words
+        for i in range(0, len(words), RECORD_WORDS):
+            yield words[i], words[i + 1], words[i + 2], words[i + 3]
+
+    def __iter__(self):
+        for op, x, y, feedrate in self.records():
+            if op == LN:
+                yield Line(Point.from_steps(x, y), feedrate)
+            elif op == GT:
+                yield Goto(Point.from_steps(x, y))
+            elif op == PU:
+                yield PEN_UP
+            elif op == PD:
+                yield PEN_DOWN
+            elif op == ZE:
+                yield ZERO
+            elif op != SP:
+                raise BinaryFormatError("Unknown opcode {}".format(op))
+
+    def close(self):
+        self.words.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load(path):
+    return BinaryCommands(path)
+
+
+def from_text(text, f):
+    '''Convert JCode(text or an iterable of lines) to binary, written to f'''
+    return write(PlotterParser(text), f)
+
+
+def to_text(binary):
+    '''JCode lines for a BinaryCommands. Converting back gives the same records.'''
+    for op, x, y, feedrate in binary.records():
+        if op == LN or op == GT:
+            yield "{} {} {}\n".format(COMMANDS[op], steps_to_mm(x), steps_to_mm(y))
+        elif op == SP:
+            yield "SP {}\n".format(feedrate)
+        else:
+            yield COMMANDS[op] + "\n"
@@ -0,0 +1,181 @@
+'''Cache of sliced JCode, keyed by the SVG and the slicing options'''
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import drawpi.config as config
+from drawpi.svgreader import OPTIONS_DEFAULT, parse, slice
+
+logger = logging.getLogger(__name__)
+
+# Part of every key, bump it when the slicer's output changes so old entries aren't used
+CACHE_VERSION = 2
+
+
+def cache_key(svg, spec_options={}):
+    '''Key for slicing svg(bytes, str or a binary file object) with the given options'''
+    options = OPTIONS_DEFAULT.copy()
+    options.update(spec_options)
+    # Doesn't change the result
+    del options["workers"]
+    digest = hashlib.sha256(str(CACHE_VERSION).encode() + b"\0")
+    if isinstance(svg, str):
+        svg = svg.encode()
+    if isinstance(svg, bytes):
+        digest.update(svg)
+    else:
+        for chunk in iter(lambda: svg.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(b"\0")
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class SliceCache:
+    '''Two tier cache of JCode: an LRU in memory, backed by files on disk. Both tiers
+    evict the least recently used entries when they go over their size limit.'''
+
+    def __init__(self, directory=config.SLICE_CACHE_DIR,
+                 memory_limit=config.SLICE_CACHE_MEMORY, disk_limit=config.SLICE_CACHE_DISK):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        # key -> JCode, most recently used last
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".jc")
+
+    def _remember(self, key, jcode):
+        '''Put into the memory tier(with the lock held)'''
+        if len(jcode) > self.memory_limit:
+            return
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        self.memory[key] = jcode
+        self.memory_size += len(jcode)
+        while self.memory_size > self.memory_limit:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def get(self, key):
+        '''The cached JCode, or None'''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                logger.debug("Slice cache memory hit {}".format(key))
+                return self.memory[key]
+        try:
+            with open(self._path(key), 'r') as f:
+                jcode = f.read()
+            # Mark as recently used, for eviction
+            os.utime(self._path(key))
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            logger.debug("Slice cache miss {}".format(key))
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self._remember(key, jcode)
+        logger.debug("Slice cache disk hit {}".format(key))
+        return jcode
+
+    def put(self, key, jcode):
+        with self.lock:
+            self._remember(key, jcode)
+        with self._writer(key) as f:
+            f.write(jcode)
+
+    def stream(self, key, lines):
+        '''Pass lines through, storing them under key once they have all gone through'''
+        with self._writer(key) as f:
+            for line in lines:
+                f.write(line)
+                yield line
+
+    def _writer(self, key):
+        return _CacheWriter(self, key)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".jc"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        # Oldest first
+        for _, size, name in sorted(entries):
+            if total <= self.disk_limit:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "memory_size": self.memory_size
+            }
+
+
+class _CacheWriter:
+    '''Writes an entry to a temporary file, moved into place only if writing finishes'''
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def __enter__(self):
+        fd, self.temp = tempfile.mkstemp(dir=self.cache.directory, suffix=".tmp")
+        self.file = os.fdopen(fd, 'w')
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.temp, self.cache._path(self.key))
+            self.cache._evict_disk()
+        else:
+            os.remove(self.temp)
+        return False
+
+
+def cached_slice(text, spec_options={}, cache=None):
+    '''slice(parse(text)), from the cache if it has been done before'''
+    cache = cache or default_cache()
+    key = cache_key(text, spec_options)
+    jcode = cache.get(key)
+    if jcode is None:
+        jcode = slice(parse(text), spec_options)
+        cache.put(key, jcode)
+    return jcode
+
+
+_default_cache = None
+
+def default_cache():
+    '''The shared cache, in config.SLICE_CACHE_DIR'''
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SliceCache()
+    return _default_cache
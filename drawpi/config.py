@@ -1,3 +1,5 @@
+import os
+
 
 # The steps per mm
 STEPS_MM = 50
@@ -31,12 +33,18 @@ PEN_UP_PULSE = 2300
 PEN_DOWN_PULSE = 1540
 # Time for servo to move in seconds.
 PEN_MOVE_DELAY = 0.5
+# Move the servo from the DMA(PWM channel 1, so PEN_SERVO must be 12 or 18), with the
+# steppers waiting PEN_MOVE_DELAY in the pulses, rather than stopping for it with pigpio
+PEN_SERVO_DMA = True
 
 
 # The feedrate for gotos(max reliable rate)
 GOTO_RATE = 25
 
-# The feedrate for zeroing
+# Zeroing goes to each endstop at the fast rate(it must be able to stop dead), backs
+# off(mm), then comes back at the slow rate for a precise position
+ZERO_FAST_RATE = 25
+ZERO_BACKOFF = 2
 ZERO_RATE = 8
 
 # Max extents - the size of the drawing area
@@ -48,3 +56,42 @@ DEFAULTS = {
 
 
 PREFERRED_PULSE_BATCH = 1000
+
+# Refill the DMA from a thread of its own(see feeder.py)
+DMA_FEEDER = True
+# Refill before less than this many seconds of pulses are left in DMA memory
+FEED_DEADLINE = 0.5
+# Seconds of pulses moved at a time, at the rate they are being run, and the fewest blocks
+FEED_BATCH_TIME = 1.0
+FEED_MIN_BATCH = 1000
+# Longest the thread sleeps between looking at the DMA(s)
+FEED_POLL = 0.05
+# Blocks waiting to go to the DMA before those adding more have to wait
+FEED_QUEUE_LIMIT = 500000
+
+# Put off clearing a step pin until the next pulse is set, when that pulse is on the
+# other axis, saving 2 control blocks(rising edges are as before, pins just stay high longer)
+MERGE_PULSES = True
+
+# Where sliced JCode is cached, and the size limits of the cache
+SLICE_CACHE_DIR = os.path.expanduser("~/.cache/drawpi")
+SLICE_CACHE_MEMORY = 64 * 1024 * 1024 # characters
+SLICE_CACHE_DISK = 512 * 1024 * 1024 # bytes
+
+# Max lines joined into a polyline, when not planning(their pulses are made together)
+POLYLINE_SEGMENTS = 256
+
+# Acceleration planning(main.py --plan)
+# The rate the steppers can start and stop at without ramping(the max reliable rate)
+START_RATE = 25
+# mm/s/s
+ACCELERATION = 300
+# How far the path may cut inside a corner taken at speed(mm), sets speeds through corners
+JUNCTION_DEVIATION = 0.05
+# The feedrate for gotos, when they are planned
+TRAVEL_RATE = 100
+# No. of moves planned together
+PLANNER_LOOKAHEAD = 32
+
+# Max blocks held by the cache of generated pulses(about 8 bytes each, the blocks are shared)
+PULSE_CACHE_BLOCKS = 4 * 1024 * 1024
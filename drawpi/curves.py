@@ -0,0 +1,80 @@
+'''Batched evaluation of svg.path segments, with numpy'''
+import math
+import numpy as np
+from svg.path import CubicBezier, QuadraticBezier, Arc
+
+# Number of chords used to estimate a segment's length
+LENGTH_SAMPLES = 16
+
+# Limits flattening to this many pieces per segment, whatever the tolerance
+MAX_PIECES = 2 ** 16
+
+
+def points(segment, ts):
+    '''Points(as a complex array) at each of the positions ts(0 to 1) along segment'''
+    t = np.asarray(ts, dtype=np.float64)
+    if isinstance(segment, CubicBezier):
+        mt = 1 - t
+        return (mt * mt * mt * segment.start + 3 * mt * mt * t * segment.control1
+                + 3 * mt * t * t * segment.control2 + t * t * t * segment.end)
+    elif isinstance(segment, QuadraticBezier):
+        mt = 1 - t
+        return mt * mt * segment.start + 2 * mt * t * segment.control + t * t * segment.end
+    elif isinstance(segment, Arc):
+        if segment.start == segment.end:
+            # Equivalent to omitting the segment
+            return np.full(t.shape, segment.start, dtype=np.complex128)
+        if segment.radius.real == 0 or segment.radius.imag == 0:
+            # Treated as a straight line
+            return segment.start + (segment.end - segment.start) * t
+        angle = np.radians(segment.theta + segment.delta * t)
+        rotation = np.exp(1j * np.radians(segment.rotation))
+        radius = segment.radius * segment.radius_scale
+        return (radius.real * np.cos(angle) + 1j * radius.imag * np.sin(angle)) * rotation + segment.center
+    elif hasattr(segment, "end"):
+        # Straight segments, and anything else with only a start and an end
+        return segment.start + (segment.end - segment.start) * t
+    return np.array([segment.point(x) for x in t], dtype=np.complex128)
+
+
+def length(segment):
+    '''Fast approximate length of a segment, as a polyline through a few samples'''
+    return float(np.abs(np.diff(points(segment, np.linspace(0, 1, LENGTH_SAMPLES + 1)))).sum())
+
+
+def sample(segment, detail, seg_length):
+    '''Points every `detail` along a segment of length seg_length(as the slicer always has)'''
+    if seg_length <= detail:
+        return points(segment, np.ones(1))
+    step = detail / seg_length
+    return points(segment, np.arange(int(1 / step)) * step)
+
+
+def pieces(segment, tolerance):
+    '''Number of equal parameter steps that keeps every chord within tolerance of
+    the segment, from a bound on its curvature'''
+    if isinstance(segment, CubicBezier):
+        # Chord error <= max|B''| / 8n^2, and |B''| <= 6 * the largest second difference
+        bend = max(abs(segment.start - 2 * segment.control1 + segment.control2),
+                   abs(segment.control1 - 2 * segment.control2 + segment.end))
+        n = math.sqrt(0.75 * bend / tolerance)
+    elif isinstance(segment, QuadraticBezier):
+        # B'' is constant, twice the second difference
+        n = math.sqrt(abs(segment.start - 2 * segment.control + segment.end) / (4 * tolerance))
+    elif isinstance(segment, Arc) and segment.start != segment.end \
+            and segment.radius.real != 0 and segment.radius.imag != 0:
+        # Sagitta of each piece, on the larger radius, is at most tolerance
+        radius = max(abs(segment.radius.real), abs(segment.radius.imag)) * segment.radius_scale
+        if tolerance >= radius:
+            return 2
+        n = math.radians(abs(segment.delta)) / (2 * math.acos(1 - tolerance / radius))
+    else:
+        return 1
+    return min(max(math.ceil(n), 1), MAX_PIECES)
+
+
+def flatten(segment, tolerance):
+    '''Points along a curved segment(excluding its start), so that the chords
+    between them never stray further than tolerance from the curve.'''
+    n = pieces(segment, tolerance)
+    return points(segment, np.arange(1, n + 1) / n)
@@ -1,6 +1,9 @@
 '''Decode the instructions'''
 COMMANDS = ["SP", "ZE", "PU", "PD", "LN", "GT"]
+from collections import namedtuple
+import io
 import logging
+import numpy as np
 import drawpi.config
 logger = logging.getLogger(__name__)
 from drawpi.point import Point
@@ -11,25 +14,74 @@ class ParseError(Exception):
     pass
 
 
+# The parsed commands. type is the name the runner dispatches on.
+class Line(namedtuple("Line", ["finish", "feedrate"])):
+    __slots__ = ()
+    type = "line"
+
+
+class Goto(namedtuple("Goto", ["finish"])):
+    __slots__ = ()
+    type = "goto"
+
+
+class Pen(namedtuple("Pen", ["state"])):
+    __slots__ = ()
+    type = "pen"
+
+
+class Zero(namedtuple("Zero", [])):
+    __slots__ = ()
+    type = "zero"
+
+
+# A command in decode_array's output(and in binary JCode files)
+RECORD_DTYPE = np.dtype([
+    ("opcode", "<i4"),
+    ("x_steps", "<i4"),
+    ("y_steps", "<i4"),
+    ("feedrate", "<i4")
+])
+
+# The no. of arguments each command takes
+ARGUMENTS = np.array([1, 0, 0, 0, 2, 2])
+# Opcodes are the index of the command
+SP, ZE, PU, PD, LN, GT = [COMMANDS.index(c) for c in ["SP", "ZE", "PU", "PD", "LN", "GT"]]
+_INT32_MAX = np.iinfo(np.int32).max
+
+# Bytes str.split() splits on, for JCode's ascii
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+# Builds a record without going through namedtuple's __new__
+_new = tuple.__new__
+
+# Commands without arguments are the same every time
+PEN_UP = Pen(False)
+PEN_DOWN = Pen(True)
+ZERO = Zero()
+
+
 class PlotterParser:
-    COMMANDS = ["SP", "ZE", "PU", "PD", "LN", "GT"]
+    COMMANDS = COMMANDS
 
     def __init__(self, commands):
-        # The command text
+        # The command text, or any iterable of lines(file, generator)
         self.text = commands
         # Default settings
-        self.settings = drawpi.config.DEFAULTS
+        self.settings = drawpi.config.DEFAULTS.copy()
         # The line no. (for error messages)
         self.line = 0
-        # The parsers for each command'''
-        self.COMMAND_PARSERS = [
-            self.parse_feedrate,
-            self.parse_gotozero,
-            self.parse_penup,
-            self.parse_pendown,
-            self.parse_line,
-            self.parse_goto
-        ]
+        self.steps_mm = drawpi.config.STEPS_MM
+        # The parsers for each command
+        self.COMMAND_PARSERS = {
+            "SP": self.parse_feedrate,
+            "ZE": self.parse_gotozero,
+            "PU": self.parse_penup,
+            "PD": self.parse_pendown,
+            "LN": self.parse_line,
+            "GT": self.parse_goto
+        }
         self.begin_parsing()
 
     def parse_error(self, message):
@@ -43,82 +95,143 @@ class PlotterParser:
                 self.settings["feedrate"] = int(command[1])
             except ValueError:
                 self.parse_error("Invalid feedrate value.")
-        return 0
+        return None
+
+    def parse_coords(self, command):
+        '''The end coord of a LN or GT, as a Point'''
+        try:
+            # utils.mm_to_steps, inlined as it is done for every line
+            x = round(float(command[1]) * self.steps_mm)
+            y = round(float(command[2]) * self.steps_mm)
+        except (ValueError, OverflowError):
+            # Not a number, inf or nan
+            self.parse_error("Invalid Coordinate Values")
+        return _new(Point, (x, y))
 
     def parse_line(self, command):
         if len(command) == 3:
-            # End coord
-            try:
-                retcom =  {
-                    "type": "line",
-                    "finish": Point(float(command[1]), float(command[2])),
-                    "feedrate": self.settings["feedrate"]
-                }
-                return retcom
-            except ValueError:
-                self.parse_error("Invalid Coordinate Values")
+            return _new(Line, (self.parse_coords(command), self.settings["feedrate"]))
         else:
             self.parse_error("LN must specify end coords.")
 
     def parse_goto(self, command):
         if len(command) == 3:
-            # End coord
-            try:
-                retcom =  {
-                    "type": "goto",
-                    "finish": Point(float(command[1]), float(command[2]))
-                }
-                return retcom
-            except ValueError:
-                self.parse_error("Invalid Coordinate Values")
+            return _new(Goto, (self.parse_coords(command),))
         else:
             self.parse_error("GT must specify end coords.")
-    
+
     def parse_gotozero(self, command):
         if len(command) == 1:
-            return {"type": "zero"}
+            return ZERO
         else:
             self.parse_error("Invalid ZE command.")
 
     def parse_pendown(self, command):
         if len(command) == 1:
-            return {"type": "pen", "state": True}
+            return PEN_DOWN
         else:
             self.parse_error("Invalid PD command.")
 
     def parse_penup(self, command):
         if len(command) == 1:
-            return {"type": "pen", "state": False}
+            return PEN_UP
         else:
             self.parse_error("Invalid PU command.")
-        
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return self.next()
-
-    def next(self):
-        try:
-            command = self.commands[self.line].strip().split()
-        except IndexError:
-            raise StopIteration
-        self.line += 1
-        if len(command):
-            if not command[0] in self.COMMANDS:
-                raise ParseError(
-                    "Not a valid command at line {}".format(self.line))
-            else:
-                com = self.COMMAND_PARSERS[self.COMMANDS.index(command[0])](command)
-                if com:
+        parsers = self.COMMAND_PARSERS
+        # Blank lines and settings(SP) don't give a command, carry on to the next line
+        for line in self.commands:
+            self.line += 1
+            command = line.split()
+            if command:
+                parser = parsers.get(command[0])
+                if parser is None:
+                    raise ParseError(
+                        "Not a valid command at line {}".format(self.line))
+                com = parser(command)
+                if com is not None:
                     return com
-                else:
-                    return self.next()
-        else:
-            return self.next()
-
-    def begin_parsing(self):
-        self.commands = self.text.split('\n')
+        raise StopIteration
 
+    next = __next__
 
+    def begin_parsing(self):
+        if isinstance(self.text, str):
+            # Split lazily, as lines are needed
+            self.commands = iter(io.StringIO(self.text))
+        else:
+            # Lines are pulled lazily, as they are needed
+            self.commands = iter(self.text)
+
+
+def decode_array(text):
+    '''Parse a whole JCode buffer(str or bytes) at once, into an array of RECORD_DTYPE.
+
+    There is a record for every command except SP, with the feedrate in force at
+    that point. Gives the same ParseErrors as PlotterParser.'''
+    buf = text.encode() if isinstance(text, str) else bytes(text)
+    tokens = buf.split()
+    if not tokens:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    data = np.frombuffer(buf, dtype=np.uint8)
+    # The line of each token, from where each starts in the buffer
+    space = _WHITESPACE[data]
+    starts = ~space
+    starts[1:] &= space[:-1]
+    lines = np.searchsorted(np.flatnonzero(data == ord("\n")), np.flatnonzero(starts), side='right') + 1
+    tokens = np.array(tokens)
+    # Commands are the first token of each line, the rest are its arguments
+    heads = np.flatnonzero(np.concatenate(([True], lines[1:] != lines[:-1])))
+    opcodes = np.full(len(heads), -1)
+    for op, name in enumerate(COMMANDS):
+        opcodes[tokens[heads] == name.encode()] = op
+    if (opcodes < 0).any() or (np.diff(heads, append=len(tokens)) - 1 != ARGUMENTS[opcodes]).any():
+        return _decode_parsed(buf)
+    is_sp = opcodes == SP
+    is_coords = (opcodes == LN) | (opcodes == GT)
+    values = np.zeros((len(heads), 3))
+    try:
+        values[is_sp, 0] = tokens[heads[is_sp] + 1].astype(np.int64)
+        values[is_coords, 1] = tokens[heads[is_coords] + 1].astype(np.float64)
+        values[is_coords, 2] = tokens[heads[is_coords] + 2].astype(np.float64)
+    except (ValueError, OverflowError):
+        return _decode_parsed(buf)
+    # utils.mm_to_steps(round half to even, like round())
+    values[:, 1:] = np.rint(values[:, 1:] * drawpi.config.STEPS_MM)
+    if not (np.abs(values) <= _INT32_MAX).all():
+        return _decode_parsed(buf)
+    # Carry each SP's feedrate forward, to the commands after it
+    last_sp = np.maximum.accumulate(np.where(is_sp, np.arange(len(heads)), -1))
+    feedrates = np.where(last_sp >= 0, values[last_sp, 0], drawpi.config.DEFAULTS["feedrate"])
+    records = np.empty(len(heads), dtype=RECORD_DTYPE)
+    records["opcode"] = opcodes
+    records["x_steps"] = values[:, 1]
+    records["y_steps"] = values[:, 2]
+    records["feedrate"] = feedrates
+    return records[~is_sp]
+
+
+def _decode_parsed(buf):
+    '''decode_array, by way of PlotterParser. Used when the fast path finds a problem,
+    so errors are reported by line as PlotterParser reports them.'''
+    parser = PlotterParser(io.TextIOWrapper(io.BytesIO(buf), newline='\n'))
+    records = []
+    for command in parser:
+        feedrate = parser.settings["feedrate"]
+        if command.type == "line":
+            record = (LN, command.finish.x, command.finish.y, feedrate)
+        elif command.type == "goto":
+            record = (GT, command.finish.x, command.finish.y, feedrate)
+        elif command.type == "pen":
+            record = (PD if command.state else PU, 0, 0, feedrate)
+        else:
+            record = (ZE, 0, 0, feedrate)
+        if any(abs(v) > _INT32_MAX for v in record):
+            # Fine for PlotterParser, but doesn't fit in a record
+            parser.parse_error("Value out of range.")
+        records.append(record)
+    return np.array(records, dtype=RECORD_DTYPE)
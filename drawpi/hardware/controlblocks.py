@@ -0,0 +1,110 @@
+'''DMA control blocks, built a batch at a time with numpy, for DMAGPIO'''
+import numpy as np
+
+CONTROL_BLOCK_SIZE = 32
+# Words of a control block
+CONTROL_BLOCK_WORDS = CONTROL_BLOCK_SIZE // 4
+# Which words are the source address and the next block's address
+SOURCE_WORD = 1
+NEXT_WORD = 5
+
+
+def control_blocks(blocks, words, bus_address):
+    '''The control blocks for blocks(the tuples DMAGPIO takes), as an (n, 8) uint32 array
+    to copy to bus_address, each pointing at the next. words(block) gives the 8 words of a
+    block, leaving its source and next for this to fill in.
+
+    Blocks are mostly shared tuples(see stepgen.py), so words is called once per distinct
+    object, and the rest is indexing.'''
+    ids = np.fromiter(map(id, blocks), dtype=np.int64, count=len(blocks))
+    _, first, index = np.unique(ids, return_index=True, return_inverse=True)
+    table = np.array([words(blocks[i]) for i in first.tolist()], dtype=np.uint32)
+    array = table.reshape(-1, CONTROL_BLOCK_WORDS)[index]
+    following = bus_address + CONTROL_BLOCK_SIZE * np.arange(1, len(blocks) + 1, dtype=np.int64)
+    array[:, NEXT_WORD] = following
+    # The last 8 bytes are padding, used to store the data
+    array[:, SOURCE_WORD] = following - 8
+    return array
+
+
+class ControlBlockRing:
+    '''Where control blocks go in DMA memory of capacity blocks, used as a ring, and how
+    full it is. The DMA runs the block at head, new blocks go from tail, and the last block
+    written ends the chain(until the next are linked on). Positions are in blocks.
+
+    It is refilled up to the high watermark, and running below the low watermark, or out
+    altogether(an underrun, the steppers stalling), is counted.'''
+
+    def __init__(self, capacity, low_watermark, high_watermark):
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.high_watermark = min(high_watermark, capacity - 1)
+        self.head = 0
+        self.tail = 0
+        # The block ending the chain, None when nothing is running
+        self.last = None
+        # Whether the DMA is meant to stop at the end of the chain(everything was flushed)
+        self.draining = False
+        # Counts
+        self.inserted = 0
+        self.wraps = 0
+        self.underruns = 0
+        self.low_water = 0
+
+    def level(self):
+        '''Blocks written that the DMA hasn't finished, including the one it is running'''
+        return (self.tail - self.head) % self.capacity
+
+    def space(self):
+        '''Blocks that can be written without reaching head, or going above the high
+        watermark'''
+        return self.high_watermark - self.level()
+
+    def moved(self, head):
+        '''Note where the DMA has got to(None if it has stopped), returning whether it ran
+        out of blocks when it wasn't meant to'''
+        if head is None:
+            underrun = self.last is not None and not self.draining
+            self.reset()
+            if underrun:
+                self.underruns += 1
+            return underrun
+        self.head = head
+        if self.level() < self.low_watermark:
+            self.low_water += 1
+        return False
+
+    def advance(self, number):
+        '''Note number blocks written from tail, the last of them ending the chain'''
+        if self.tail + number >= self.capacity:
+            self.wraps += 1
+        self.tail = (self.tail + number) % self.capacity
+        self.last = (self.tail - 1) % self.capacity
+        self.inserted += number
+
+    def wrap(self, data, bus_address):
+        '''Point the blocks of data(from control_blocks, at tail) that are past the end of
+        memory at bus_address back to its start, returning how many fit before the end'''
+        size = self.capacity * CONTROL_BLOCK_SIZE
+        for word in (NEXT_WORD, SOURCE_WORD):
+            column = data[:, word]
+            column[column >= bus_address + size] -= size
+        return min(len(data), self.capacity - self.tail)
+
+    def reset(self):
+        '''Start again from the beginning of memory, with nothing running'''
+        self.head = self.tail = 0
+        self.last = None
+        self.draining = False
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "level": self.level(),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "inserted": self.inserted,
+            "wraps": self.wraps,
+            "underruns": self.underruns,
+            "low_water": self.low_water
+        }
@@ -0,0 +1,132 @@
+'''A thread that keeps DMAGPIO's memory topped up, so the DMA doesn't run dry while
+pulses aren't being generated(a long parse, or the pen moving)'''
+import logging
+import threading
+import time
+from drawpi import config
+
+logger = logging.getLogger(__name__)
+
+
+class DMAFeeder:
+    '''Stands in for a DMAGPIO, moving the blocks added to it into DMA memory from a
+    thread of its own.
+
+    The thread measures how fast the DMA runs blocks, from how far it gets through
+    them(current_control_block, as the ring's head). It refills when less than deadline
+    seconds of them are left, with batch_time seconds' worth, and sleeps until then.
+    add_pulses blocks while more than queue_limit blocks are waiting to go.'''
+
+    def __init__(self, dma, deadline=config.FEED_DEADLINE, batch_time=config.FEED_BATCH_TIME,
+                 queue_limit=config.FEED_QUEUE_LIMIT):
+        self.dma = dma
+        self.deadline = deadline
+        self.batch_time = batch_time
+        self.queue_limit = queue_limit
+        # Guards the DMA, and is waited on by the thread(for blocks) and producers(for room)
+        self.condition = threading.Condition()
+        self.draining = False
+        self.closed = False
+        # Blocks added that aren't in memory with the DMA started on them yet. Set under
+        # the condition, read without it by is_active
+        self.unstarted = 0
+        # Blocks run per second, 0 until measured
+        self.rate = 0
+        self.refills = 0
+        self.producer_waits = 0
+        self.thread = threading.Thread(target=self._run, name="DMAFeeder", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        ring = self.dma.ring
+        last_time = time.monotonic()
+        last_run = 0
+        with self.condition:
+            while not self.closed:
+                # Where it has got to, without adding any
+                self.dma.update(self.draining, 0)
+                now = time.monotonic()
+                run = ring.inserted - ring.level()
+                if self.dma.is_active() and now > last_time:
+                    measured = max(run - last_run, 0) / (now - last_time)
+                    self.rate = measured if not self.rate else 0.8 * self.rate + 0.2 * measured
+                last_time, last_run = now, run
+
+                left = ring.level() / self.rate if self.rate else 0
+                if self.dma.blocks_queue and (left < self.deadline or not self.dma.is_active()):
+                    inserted = ring.inserted
+                    self.dma.update(self.draining, self._batch())
+                    # Only now they're in memory and it has been started
+                    self.unstarted = len(self.dma.blocks_queue)
+                    # Room for the producers
+                    self.condition.notify_all()
+                    if ring.inserted != inserted:
+                        self.refills += 1
+                        continue
+                wait = config.FEED_POLL
+                if self.rate and self.dma.is_active() and self.dma.blocks_queue:
+                    # Until it gets down to the deadline
+                    wait = min(wait, max(left - self.deadline, 0.001))
+                self.condition.wait(wait)
+
+    def _batch(self):
+        if not self.rate:
+            # Not known yet, as many as fit
+            return None
+        return max(config.FEED_MIN_BATCH, int(self.rate * self.batch_time))
+
+    def add_pulses(self, blocks):
+        '''Queue blocks for the DMA, waiting while too many are queued already'''
+        with self.condition:
+            if len(self.dma.blocks_queue) > self.queue_limit:
+                logger.debug("DMA queue full, waiting")
+                self.producer_waits += 1
+            while len(self.dma.blocks_queue) > self.queue_limit and not self.closed:
+                self.condition.wait()
+            self.unstarted += len(blocks)
+            self.dma.add_pulses(blocks)
+            self.draining = False
+            self.condition.notify_all()
+
+    def update(self, drain=False, limit=None):
+        '''The thread does the updating, this only says whether the DMA may run dry'''
+        with self.condition:
+            self.draining = drain
+            self.condition.notify_all()
+
+    def is_active(self):
+        '''Whether the DMA is running, or has blocks to. Doesn't wait for the thread, so
+        it can be polled quickly(zeroing). Blocks the thread has taken from the queue
+        but not started the DMA on yet still count.'''
+        return bool(self.unstarted) or self.dma.is_active()
+
+    def stop(self):
+        with self.condition:
+            self.dma.stop()
+            self.unstarted = 0
+            self.condition.notify_all()
+
+    def init_servo(self, gpio, pin, width):
+        with self.condition:
+            self.dma.init_servo(gpio, pin, width)
+
+    def set_servo(self, width):
+        self.dma.set_servo(width)
+
+    def stats(self):
+        with self.condition:
+            stats = self.dma.stats()
+            stats.update({
+                "queued": len(self.dma.blocks_queue),
+                "rate": self.rate,
+                "refills": self.refills,
+                "producer_waits": self.producer_waits
+            })
+            return stats
+
+    def close(self):
+        '''Stop the thread'''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from .rpgpio_private import *
+from drawpi.hardware.controlblocks import NEXT_WORD, ControlBlockRing, control_blocks
 
 import time
 from collections import deque
@@ -14,6 +15,10 @@ class GPIO(object):
     MODE_INPUT_NOPULL = 2
     MODE_INPUT_PULLUP = 3
     MODE_INPUT_PULLDOWN = 4
+    MODE_ALT0 = 5
+    MODE_ALT5 = 6
+    # FSEL values of the alternative functions
+    _ALT_FUNCTIONS = {MODE_ALT0: 4, MODE_ALT5: 2}
 
     def __init__(self):
         """ Create object which can control GPIO.
@@ -48,6 +53,9 @@ class GPIO(object):
         if mode == self.MODE_OUTPUT:
             v |= (1 << ((pin % 10) * 3))  # output value, base on input
             self._mem.write_int(address, v)
+        elif mode in self._ALT_FUNCTIONS:
+            v |= self._ALT_FUNCTIONS[mode] << ((pin % 10) * 3)
+            self._mem.write_int(address, v)
         else:
             self._mem.write_int(address, v)
             self._pull_up_dn(pin, mode)
@@ -86,7 +94,13 @@ class DMAGPIO(DMAProto):
     _DMA_CONTROL_BLOCK_SIZE = 32
     _DMA_CHANNEL = 4
     _BLOCK_NUMBER = 983040
-    _PREFERRED_BATCH = _BLOCK_NUMBER / 10
+    # Refilled up to the high watermark, below the low one is a warning
+    _LOW_WATERMARK = _BLOCK_NUMBER // 10
+    _HIGH_WATERMARK = _BLOCK_NUMBER - 1
+    # Pins PWM channel 1 comes out on, and the mode for it
+    _SERVO_PINS = {12: GPIO.MODE_ALT0, 18: GPIO.MODE_ALT5}
+    # A servo frame(20 ms) in ticks of the 100 MHz PWM clock
+    _SERVO_RANGE = 20000 * 100
 
     def __init__(self):
         """ Create object which control GPIO pins via DMA(Direct Memory
@@ -99,7 +113,8 @@ class DMAGPIO(DMAProto):
             operating system.
         """
         super(DMAGPIO, self).__init__(self._BLOCK_NUMBER*self._DMA_CONTROL_BLOCK_SIZE, self._DMA_CHANNEL)
-        self.__current_address = 0
+        self.ring = ControlBlockRing(self._BLOCK_NUMBER, self._LOW_WATERMARK,
+                                     self._HIGH_WATERMARK)
 
         # get helpers registers, this class uses PWM module to create precise
         # delays
@@ -122,99 +137,142 @@ class DMAGPIO(DMAProto):
         self._pulse_stride = (DMA_TI_STRIDE_D_STRIDE(12)
                               | DMA_TI_STRIDE_S_STRIDE(4))
 
+        # servo blocks write the pulse width to PWM channel 1, delays use
+        # channel 2
+        self._servo_info = DMA_TI_NO_WIDE_BURSTS | DMA_TI_WAIT_RESP
+        self._servo_destination = PHYSICAL_PWM_BUS + PWM_DAT1
+        self._servo_control = 0
+        self._clock_ready = False
+
         self.logger = logging.getLogger(__name__ + ".DMAGPIO")
         self.blocks_queue = deque()
 
+    def init_servo(self, gpio, pin, width):
+        """ Drive a servo from PWM channel 1, so ("servo", pin, width) blocks
+            move it in time with the pulses. Call before running.
+        :param gpio: GPIO object, to give the pin to PWM.
+        :param pin: pin number, 12 or 18.
+        :param width: pulse width to start with, in us.
+        """
+        if pin not in self._SERVO_PINS:
+            raise ValueError("PWM can't drive a servo on pin {}".format(pin))
+        self._setup_clock()
+        self._servo_control = PWM_CTL_PWEN1 | PWM_CTL_MSEN1
+        self._pwm.write_int(PWM_RNG1, self._SERVO_RANGE)
+        self.set_servo(width)
+        self._pwm.write_int(PWM_CTL, self._servo_control)
+        gpio.init(pin, self._SERVO_PINS[pin])
+
+    def set_servo(self, width):
+        """ Set the servo pulse width now, whatever is running.
+        :param width: pulse width in us.
+        """
+        self._pwm.write_int(PWM_DAT1, width * 100)
+
     def add_pulses(self, blocks):
         for b in blocks:
             self.blocks_queue.append(b)
 
-    def update(self):
-        if len(self.blocks_queue) > 0:
-            # Must get before just in case running suddenly stops
-            running_address = self.current_control_block()
-            if not self.is_active():
-                # Can start from begining
-                self.clear()
-                self._insert_blocks(min(self._BLOCK_NUMBER, len(self.blocks_queue)))
+    def update(self, drain=False, limit=None):
+        """ Move queued blocks into DMA memory, starting it if it isn't
+            running.
+        :param drain: True if the DMA is meant to stop when it has run them,
+        rather than that being an underrun.
+        :param limit: most blocks to move, None for as many as fit.
+        """
+        running_address = self.current_control_block()
+        if not self.is_active():
+            running_address = None
+        head = None if running_address is None else running_address // self._DMA_CONTROL_BLOCK_SIZE
+        if self.ring.moved(head):
+            self.logger.warning("DMA underrun, it ran out of blocks ({} so far)".format(
+                self.ring.underruns))
+        elif head is not None and self.ring.level() < self.ring.low_watermark:
+            self.logger.debug("DMA below low watermark, {} blocks left".format(self.ring.level()))
+        number = min(len(self.blocks_queue), self.ring.space())
+        if limit is not None:
+            number = min(number, limit)
+        if number > 0:
+            starting = self.ring.last is None
+            self._insert_blocks(number)
+            if starting:
                 self.logger.debug("Started a DMA session")
                 self.run()
-            else:
-                current_end = self.__current_address
-                if current_end >= self._phys_memory.get_size():
-                    # Insert at beginning [++++^---------] 
-                    if  1 < running_address < self._phys_memory.get_size():
-                        self.logger.debug("Filling starter gap blocks")
-                        self.__current_address = 0
-                        self._insert_blocks(min(len(self.blocks_queue), running_address - 1))
-                        self._redirect_block(current_end-self._DMA_CONTROL_BLOCK_SIZE, 0)
-                    else:
-                        self.logger.debug("Cannot fill starter gap cos of strange running_address")
-                elif current_end > running_address:
-                    # Insert next block   [     ^----++++]
-                    self.logger.debug("Filling Tight Gap Blocks")
-                    self._insert_blocks(min(len(self.blocks_queue), self._phys_memory.get_size()-current_end))
-                    self._redirect_block(current_end-self._DMA_CONTROL_BLOCK_SIZE, current_end)
-                elif current_end < running_address:
-                    # Insert next block   [----++++++^---]
-                    self.logger.debug("Filling Healthy Gap Blocks")
-                    self._insert_blocks(min(len(self.blocks_queue), running_address-current_end))
-                    self._redirect_block(current_end-self._DMA_CONTROL_BLOCK_SIZE, current_end)
-                elif current_end == running_address:
-                    self.logger.debug("It caught me, or I caught it?")
-                else:
-                    self.logger.debug("Nothing to do")
-        else:
-            self.logger.debug("Nothing to do")
+        self.ring.draining = drain and not self.blocks_queue
 
     def _redirect_block(self, block_address, target_block_address):
         if block_address >= self._phys_memory.get_size() or target_block_address >= self._phys_memory.get_size():
             raise IndexError("Referenced blocks are outside allocated memory")
         self._phys_memory.write_int(block_address + 20, self._phys_memory.get_bus_address()+target_block_address)
 
+    def _block_words(self, p):
+        """ The words of a control block for a block, without its source and
+            next addresses(see controlblocks.py).
+        """
+        if len(p) == 2:
+            return (self._pulse_info, 0, self._pulse_destination,
+                    self._pulse_length, self._pulse_stride, 0, p[0], p[1])
+        elif len(p) == 1:
+            # Is a delay
+            length = p[0] << 4  # * 16
+            return (self._delay_info, 0, self._delay_destination, length,
+                    self._delay_stride, 0, 0, 0)
+        else:
+            # Is a servo pulse width, ("servo", pin, width)
+            return (self._servo_info, 0, self._servo_destination, 4, 0, 0,
+                    p[2] * 100, 0)
 
     def _insert_blocks(self, number):
-        if self.__current_address + (number * self._DMA_CONTROL_BLOCK_SIZE) > self._phys_memory.get_size():
+        """ Write number blocks from the queue at the ring's tail, and link
+            them on to the end of the chain.
+        """
+        if number > self.ring.space():
             raise MemoryError("Out of allocated memory.")
         elif number > len(self.blocks_queue) :
             raise IndexError("Cannot insert this many blocks.")
-        # The address of the first CB to add
-        current_address = self.__current_address
-        # Loop thru pulses
-        for _ in range(number):
-            p = self.blocks_queue.popleft()
-            # Address of next cb
-            next1 = current_address + self._DMA_CONTROL_BLOCK_SIZE + self._phys_memory.get_bus_address()
-            source = next1 - 8  # last 8 bytes are padding, use it to store data
-            if len(p) > 1:
-                data = (
-                    self._pulse_info, source, self._pulse_destination,
-                    self._pulse_length, self._pulse_stride, next1,
-                    p[0], p[1]
-                )
-            else:
-                # Is a delay
-                length = p[0] << 4  # * 16
-                data = (
-                self._delay_info, source, self._delay_destination, length,
-                self._delay_stride, next1, 0, 0
-                )
-
-            self._phys_memory.write(current_address, "8I", data)
-            current_address += self._DMA_CONTROL_BLOCK_SIZE
-        oldaddr = self.__current_address
-        self.__current_address = current_address
+        elif number == 0:
+            return
+        popleft = self.blocks_queue.popleft
+        blocks = [popleft() for _ in range(number)]
+        start = self.ring.tail * self._DMA_CONTROL_BLOCK_SIZE
+        bus_address = self._phys_memory.get_bus_address()
+        # Built all at once, then copied in one go(two, if it wraps round)
+        data = control_blocks(blocks, self._block_words, bus_address + start)
+        fits = self.ring.wrap(data, bus_address)
         # Finalise the block
-        self._phys_memory.write_int(self.__current_address + 20
-                                    - self._DMA_CONTROL_BLOCK_SIZE, 0)
-        self.logger.info("DMA Inserted and Finalised {}MB".format(round((self.__current_address - oldaddr)/1048576.0, 2)))
-
-
-    def run_stream(self):
-        """ Run DMA module in stream mode, i.e. does'n finalize last block
-            and do not check if there is anything to do.
+        data[-1, NEXT_WORD] = 0
+        self._phys_memory.write_buffer(start, data[:fits])
+        if fits < number:
+            self._phys_memory.write_buffer(0, data[fits:])
+        last = self.ring.last
+        self.ring.advance(number)
+        if last is not None:
+            self._link(last * self._DMA_CONTROL_BLOCK_SIZE, start)
+        self.logger.info("DMA Inserted and Finalised {}MB".format(round(data.nbytes/1048576.0, 2)))
+
+    def _link(self, block_address, target_block_address):
+        """ Point the end of the chain at new blocks, while the DMA runs.
         """
-        # configure PWM hardware module which will clocks DMA
+        self._redirect_block(block_address, target_block_address)
+        # It may already have loaded the block, without the new next address. That
+        # can only be written while it's paused
+        if self.current_control_block() == block_address and self._pause_dma():
+            if self.current_control_block() == block_address:
+                self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_NEXTCONBK,
+                                    self._phys_memory.get_bus_address() + target_block_address)
+            self._resume_dma()
+        if not self.is_active():
+            # Too late, it had finished
+            self.ring.underruns += 1
+            self.logger.warning("DMA underrun, it finished before more blocks were linked on")
+            self.run(target_block_address)
+
+    def _setup_clock(self):
+        """ Clock the PWM hardware module at 100 MHz, once, so a servo on
+            channel 1 keeps its pulses between runs.
+        """
+        if self._clock_ready:
+            return
         self._pwm.write_int(PWM_CTL, 0)
         # disable
         self._clock.write_int(CM_PWM_CNTL, CM_PASSWORD | CM_SRC_PLLD)
@@ -224,39 +282,59 @@ class DMAGPIO(DMAProto):
         self._clock.write_int(CM_PWM_DIV, CM_PASSWORD | CM_DIV_VALUE(5))
         self._clock.write_int(CM_PWM_CNTL,
                               CM_PASSWORD | CM_SRC_PLLD | CM_CNTL_ENABLE)
-        self._pwm.write_int(PWM_RNG1, 100)
+        self._clock_ready = True
+
+    def run_stream(self, address=0):
+        """ Run DMA module in stream mode, i.e. does'n finalize last block
+            and do not check if there is anything to do.
+        """
+        # configure PWM hardware module which will clocks DMA, on channel 2
+        # so channel 1 is left for a servo
+        self._setup_clock()
+        self._pwm.write_int(PWM_CTL, self._servo_control)
+        self._pwm.write_int(PWM_RNG2, 100)
         self._pwm.write_int(PWM_DMAC, PWM_DMAC_ENAB | PWM_DMAC_PANIC(15)
                             | PWM_DMAC_DREQ(15))
-        self._pwm.write_int(PWM_CTL, PWM_CTL_CLRF)
+        self._pwm.write_int(PWM_CTL, self._servo_control | PWM_CTL_CLRF)
         # enable
-        self._pwm.write_int(PWM_CTL, PWM_CTL_USEF1 | PWM_CTL_PWEN1)
-        super(DMAGPIO, self)._run_dma()
+        self._pwm.write_int(PWM_CTL, self._servo_control | PWM_CTL_USEF2
+                            | PWM_CTL_PWEN2)
+        super(DMAGPIO, self)._run_dma(address)
 
-    def run(self):
+    def run(self, address=0):
         """ Run DMA module and start sending specified pulses.
-        :param loop: If true, run pulse sequence in infinite loop. Otherwise
+        :param address: offset of the block to start from.
         """
-        if self.__current_address == 0:
+        if self.ring.last is None:
             raise RuntimeError("Nothing was added.")
-        self.run_stream()
+        self.run_stream(address)
 
     def stop(self):
-        """ Stop any DMA activities.
+        """ Stop any DMA activities. A servo keeps its pulses.
         """
-        self._pwm.write_int(PWM_CTL, 0)
+        self._pwm.write_int(PWM_CTL, self._servo_control)
         super(DMAGPIO, self)._stop_dma()
+        # Meant to stop, whatever was left
+        self.ring.reset()
+        self.blocks_queue.clear()
 
     def clear(self):
         """ Remove any specified pulses. Doesn't affect currently running
             sequence.
         """
-        self.__current_address = 0
+        self.ring.reset()
 
     def current_address(self):
         """ Get current buffer offset.
         :return: current buffer offset in bytes.
         """
-        return self.__current_address
+        return self.ring.tail * self._DMA_CONTROL_BLOCK_SIZE
+
+    def stats(self):
+        """ How full the ring of control blocks is, and what it has done.
+        :return: dictionary of ControlBlockRing.stats.
+        """
+        return self.ring.stats()
 
     def control_block_size(self):
         """ Get control block size.
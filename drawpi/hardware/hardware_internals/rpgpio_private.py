@@ -58,6 +58,7 @@ DMA_TI_DEST_DREQ = 1 << 6
 DMA_CS_RESET = 1 << 31
 DMA_CS_ABORT = 1 << 30
 DMA_CS_DISDEBUG = 1 << 28
+DMA_CS_PAUSED = 1 << 4
 DMA_CS_END = 1 << 1
 DMA_CS_ACTIVE = 1 << 0
 DMA_TI_PER_MAP_PWM = 5
@@ -79,6 +80,7 @@ PWM_DMAC = 0x08
 PWM_RNG1 = 0x10
 PWM_RNG2 = 0x20
 PWM_FIFO = 0x18
+PWM_DAT1 = 0x14
 PWM_CTL_MODE1 = 1 << 1
 PWM_CTL_MODE2 = 1 << 9
 PWM_CTL_PWEN1 = 1 << 0
@@ -86,6 +88,7 @@ PWM_CTL_PWEN2 = 1 << 8
 PWM_CTL_CLRF = 1 << 6
 PWM_CTL_USEF1 = 1 << 5
 PWM_CTL_USEF2 = 1 << 13
+PWM_CTL_MSEN1 = 1 << 7
 PWM_DMAC_ENAB = 1 << 31
 PWM_DMAC_PANIC = (lambda x: x << 8)
 PWM_DMAC_DREQ = (lambda x: x)
@@ -141,6 +144,12 @@ class PhysicalMemory(object):
     def write(self, address, fmt, data):
         struct.pack_into(fmt, self._memmap, address, *data)
 
+    def write_buffer(self, address, data):
+        """ Copy a bytes-like object(e.g. a numpy array) to address, at once.
+        """
+        data = memoryview(data).cast('B')
+        self._memmap[address:address + len(data)] = data
+
     def read_int(self, address):
         return ctypes.c_uint32.from_buffer(self._memmap, address).value
 
@@ -210,12 +219,12 @@ class DMAProto(object):
         # prepare dma registers memory map
         self._dma = PhysicalMemory(PERI_BASE + DMA_BASE)
 
-    def _run_dma(self):
-        """ Run DMA module from created buffer.
+    def _run_dma(self, offset=0):
+        """ Run DMA module from created buffer, from the block at offset.
         """
         self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CS, DMA_CS_END)
         self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CONBLK_AD,
-                            self._phys_memory.get_bus_address())
+                            self._phys_memory.get_bus_address() + offset)
         cs = DMA_CS_PRIORITY(7) | DMA_CS_PANIC_PRIORITY(7) | DMA_CS_DISDEBUG
         self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CS, cs)
         cs |= DMA_CS_ACTIVE
@@ -232,6 +241,25 @@ class DMAProto(object):
         cs |= DMA_CS_RESET
         self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CS, cs)
 
+    def _pause_dma(self):
+        """ Pause DMA, waiting till it has. Returns False if it wasn't running
+            (or finished instead).
+        """
+        cs = self._dma.read_int(self._DMA_CHANNEL_ADDRESS + DMA_CS)
+        if not cs & DMA_CS_ACTIVE:
+            return False
+        self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CS, cs & ~DMA_CS_ACTIVE)
+        while not self._dma.read_int(self._DMA_CHANNEL_ADDRESS + DMA_CS) & DMA_CS_PAUSED:
+            if self.current_control_block() is None:
+                return False
+        return True
+
+    def _resume_dma(self):
+        """ Carry on after _pause_dma.
+        """
+        cs = self._dma.read_int(self._DMA_CHANNEL_ADDRESS + DMA_CS)
+        self._dma.write_int(self._DMA_CHANNEL_ADDRESS + DMA_CS, cs | DMA_CS_ACTIVE)
+
     def is_active(self):
         """ Check if DMA is working. Method can check if single sequence
             still active or cycle sequence is working.
@@ -1,29 +1,55 @@
 from drawpi import config
 from drawpi.point import Point
 from drawpi.utils import frequency_to_delay, mm_to_steps
-from drawpi.hardware.steppers import XYSteppers
+from drawpi.planner import step_delays
+from drawpi.hardware.stepgen import (X_STEP_MASK, Y_STEP_MASK, direction_masks, goto_masks,
+                                     line_masks, polyline_records, pulse_blocks, record_blocks,
+                                     segment_directions)
+from drawpi.hardware.pulsecache import default_pulse_cache
+from drawpi.hardware.feeder import DMAFeeder
 import logging
 import time
-import pigpio
-from drawpi.hardware.hardware_internals.rpgpio import GPIO, DMAGPIO
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
+class ZeroError(Exception):
+    '''An endstop wasn't reached when zeroing'''
+    pass
+
+
 class Plotter:
     '''Manages the plotter, and its capabilities'''
 
-    def __init__(self):
+    def __init__(self, gpio=None, dma=None, pi=None, sleep=time.sleep, pulse_cache=None):
+        '''Uses the real hardware, unless stand-ins are given(see simulator.py). Pulses
+        for moves come from pulse_cache, or the shared cache.'''
         # Store location in STEPS
         self.location = Point(0, 0)
 
-        # Store current direction
-        self.direction = (True, True)
-
-
-        self.gpio = GPIO()
-        self.dma = DMAGPIO()
-        self.pi = pigpio.pi()
+        # Store current direction, None until the pins have been set
+        self.direction = None
+        # Whether the pen is down, None when not known
+        self.pen_down = None
+
+        if gpio is None or dma is None:
+            from drawpi.hardware.hardware_internals.rpgpio import GPIO, DMAGPIO
+        if pi is None and not config.PEN_SERVO_DMA:
+            import pigpio
+            pi = pigpio.pi()
+        self.gpio = gpio if gpio is not None else GPIO()
+        # The real DMA is refilled from a thread(stand-ins run what they are given at once)
+        self.feeder = None
+        if dma is None:
+            dma = DMAGPIO()
+            if config.DMA_FEEDER:
+                self.feeder = dma = DMAFeeder(dma)
+        self.dma = dma
+        # Only needed for the pen, when the DMA doesn't move it
+        self.pi = pi
+        self.sleep = sleep
+        self.pulse_cache = pulse_cache if pulse_cache is not None else default_pulse_cache()
 
         # Setup pins as outputs/inputs
         self.setup_pins()
@@ -44,63 +70,73 @@ class Plotter:
 
     def add_pulse(self, pulse):
         self.pulses.append((pulse[0], pulse[1]))
-        if len(pulse) > 2:
+        if len(pulse) > 2 and pulse[2]:
             self.pulses.append((pulse[2],))
         if len(self.pulses) > config.PREFERRED_PULSE_BATCH:
-            logger.debug("Committing Pulses")
-            # Enable steppers
-            self.gpio.clear(config.ENABLE_STEPPER)
-            self.dma.add_pulses(self.pulses)
-            self.pulses = []
-            self.dma.update()
-
-    def flush_pulses(self):
-        logger.debug("Flushing Pulses")
+            self._commit_pulses()
+
+    def add_blocks(self, blocks):
+        '''Add blocks, already split as add_pulse splits pulses'''
+        self.pulses.extend(blocks)
+        if len(self.pulses) > config.PREFERRED_PULSE_BATCH:
+            self._commit_pulses()
+
+    def _commit_pulses(self):
+        logger.debug("Committing Pulses")
+        # Enable steppers
+        self.gpio.clear(config.ENABLE_STEPPER)
         self.dma.add_pulses(self.pulses)
         self.pulses = []
         self.dma.update()
 
+    def flush_pulses(self, drain=False):
+        '''Give the DMA all the pulses, drain if it is then meant to run out of them'''
+        logger.debug("Flushing Pulses")
+        self.dma.add_pulses(self.pulses)
+        self.pulses = []
+        self.dma.update(drain)
+
     def wait_till_idle(self):
-        self.flush_pulses()
+        self.flush_pulses(drain=True)
         logger.debug("Waiting till Idle")
         while self.dma.is_active():
-            self.dma.update()
-            time.sleep(0.1)
+            self.dma.update(drain=True)
+            self.sleep(0.1)
 
     def stop(self):
         # Disable the steppers first
         self.gpio.set(config.ENABLE_STEPPER)
         self.dma.stop()
+        # Blocks that would have set them may not have been run
+        self.direction = None
+        self.pen_down = None
 
     def shutdown(self):
         '''Shutdown tidily'''
         self.stop()
-        self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_UP_PULSE)
-        self.pi.stop()
+        if config.PEN_SERVO_DMA:
+            self.dma.set_servo(config.PEN_UP_PULSE)
+        else:
+            self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_UP_PULSE)
+        self.close()
+        if self.pi is not None:
+            self.pi.stop()
+
+    def close(self):
+        '''Stop the thread refilling the DMA, if there is one, when the plotter won't be
+        used again(it would otherwise keep polling the DMA, and hold on to its memory)'''
+        if self.feeder is not None:
+            self.feeder.close()
+            self.feeder = None
 
 
     def _set_direction(self, dirX, dirY):
-        set = 0
-        reset = 0
-        if dirX != config.X_INVERTED:
-            set |= 1 << config.X_DIR
-        else:
-            reset |= 1 << config.X_DIR
-        if dirY != config.Y_INVERTED:
-            set |= 1 << config.Y_DIR
-        else:
-            reset |= 1 << config.Y_DIR
+        if self.direction == (dirX, dirY):
+            return
+        self.direction = (dirX, dirY)
+        set, reset = direction_masks(dirX, dirY)
         self.add_pulse((set, reset, 0))
 
-    def _pulse_steppers(self, stepx, stepy, delay):
-        bitmask = 0
-        if stepx:
-            bitmask |= 1 << config.X_STEP
-        if stepy:
-            bitmask |= 1 << config.Y_STEP
-        self.add_pulse((bitmask, 0, int(delay / 2)))
-        self.add_pulse((0, bitmask, int((delay + 1) / 2)))
-
     def _get_steps_to(self, point):
         # Get the steps to a point
         diff=point - self.location
@@ -124,19 +160,12 @@ class Plotter:
         # Rate is a frequency, get us between pulses
         delay_per_pulseset=frequency_to_delay(mm_to_steps(config.GOTO_RATE))
 
-        # -DEBUG-
-        pulse_count=0
-
-        # Add pulses until correct no. of steps is achieved.
-        while (x > 0) or (y > 0):
-            # Decrement
-            if x > 0:
-                x -= 1
-            if y > 0:
-                y -= 1
-            # Add the pulse for the steppers
-            self._pulse_steppers(x > 0, y > 0, delay_per_pulseset)
-            pulse_count += 1
+        # Add pulses until correct no. of steps is achieved. Each axis is decremented
+        # before its pulse, so it steps on pulse k if k < steps - 1.
+        pulse_count=max(x, y)
+        self.add_blocks(self.pulse_cache.get(
+            ("goto", x, y, delay_per_pulseset),
+            lambda: pulse_blocks(goto_masks(x, y), delay_per_pulseset)))
 
         logger.debug("GOTO generated {} pulses".format(pulse_count))
         # Update location
@@ -144,49 +173,83 @@ class Plotter:
 
     def penup(self):
         '''Set servo to move pen up'''
-        self.wait_till_idle()
-        self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_UP_PULSE)
-        time.sleep(config.PEN_MOVE_DELAY)
+        self._move_pen(False)
 
     def pendown(self):
         '''Set servo to move pen down'''
-        self.wait_till_idle()
-        self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_DOWN_PULSE)
-        time.sleep(config.PEN_MOVE_DELAY)
+        self._move_pen(True)
+
+    def _move_pen(self, down):
+        # Nothing to do if it's already there
+        if self.pen_down == down:
+            return
+        self.pen_down = down
+        width = config.PEN_DOWN_PULSE if down else config.PEN_UP_PULSE
+        if config.PEN_SERVO_DMA:
+            # The DMA moves the servo when it gets to it, and waits for it, while the
+            # pulses after are generated as usual
+            self.add_blocks([("servo", config.PEN_SERVO, width),
+                             (int(config.PEN_MOVE_DELAY * 1e6),)])
+        else:
+            self.wait_till_idle()
+            self.pi.set_servo_pulsewidth(config.PEN_SERVO, width)
+            self.sleep(config.PEN_MOVE_DELAY)
 
     def zero_me(self):
         '''Zero the plotter(move it to home)'''
-        # The delay in us
-        delay=frequency_to_delay(mm_to_steps(config.ZERO_RATE))
-
-        # 1 Second of waves are generated at a time(just in case)
-        safety_pregen_no=mm_to_steps(config.ZERO_RATE)
         # For each axis
-        for is_x, triggerp, extent, endinverted in [
-            [True,
-                config.X_MIN, config.X_EXTENT, config.X_END_INVERTED],
-            [False, config.Y_MIN, config.Y_EXTENT, config.Y_END_INVERTED]
+        for step_mask, triggerp, extent, endinverted in [
+            [X_STEP_MASK, config.X_MIN, config.X_EXTENT, config.X_END_INVERTED],
+            [Y_STEP_MASK, config.Y_MIN, config.Y_EXTENT, config.Y_END_INVERTED]
                                       ]:
 
             self.wait_till_idle()
 
-            theoretical_maximum_steps = mm_to_steps(extent)
-            steps_moved = 0
-            while steps_moved < theoretical_maximum_steps:
-                # This limits just in case of malfunction (inversion for endstops -> high when pressed)
-                endstop = (self.gpio.read(triggerp) == 1) == endinverted
-                if endstop:
-                    self.stop()
-                    logger.info("ZERO AXIS SUCCESS")
-                    break
-                if not self.dma.is_active():
-                    self._set_direction(False, False)
-                    for _ in range(safety_pregen_no):
-                        steps_moved += 1
-                        self._pulse_steppers(is_x, not is_x, delay)
+            # Quickly to the endstop, unless already there(limited just in case of malfunction)
+            if not self._endstop(triggerp, endinverted) and not self._approach_endstop(
+                    step_mask, mm_to_steps(extent), config.ZERO_FAST_RATE, triggerp, endinverted):
+                # Where it is isn't known, so neither is how to get back
+                raise ZeroError("Endstop on pin {} not reached within {}mm".format(triggerp, extent))
+            # Back off, then slowly back to it, for the precise position
+            backoff = mm_to_steps(config.ZERO_BACKOFF)
+            self._set_direction(True, True)
+            self.add_blocks(self._zero_blocks(step_mask, backoff, config.ZERO_FAST_RATE))
+            self._commit_pulses()
+            self.wait_till_idle()
+            if self._approach_endstop(step_mask, 2 * backoff, config.ZERO_RATE,
+                                      triggerp, endinverted):
+                logger.info("ZERO AXIS SUCCESS")
+            else:
+                logger.warning("ZERO AXIS FAILED, endstop not reached")
         # We are now zeroed.
         self.location=Point(0, 0)
 
+    def _endstop(self, pin, inverted):
+        # (inversion for endstops -> high when pressed)
+        return (self.gpio.read(pin) == 1) == inverted
+
+    def _zero_blocks(self, step_mask, steps, rate):
+        delay = frequency_to_delay(mm_to_steps(rate))
+        return self.pulse_cache.get(("zero", step_mask, steps, delay),
+                                    lambda: pulse_blocks(np.full(steps, step_mask), delay))
+
+    def _approach_endstop(self, step_mask, steps, rate, pin, inverted):
+        '''Step towards the endstop on pin until it is pressed, returning whether it was
+        before steps ran out'''
+        self._set_direction(False, False)
+        self.add_blocks(self._zero_blocks(step_mask, steps, rate))
+        self._commit_pulses()
+        # Sample the endstop as fast as possible, so it is stopped within a step
+        while self.dma.is_active():
+            if self._endstop(pin, inverted):
+                self.stop()
+                # It may have stopped between a step pin's set and clear, and a pin left
+                # high would lose the next step on it
+                self.gpio.clear(config.X_STEP)
+                self.gpio.clear(config.Y_STEP)
+                return True
+        return self._endstop(pin, inverted)
+
     def draw_line(self, start, finish, rate):
         logger.info("LINE from {} to {}".format(str(start), str(finish)))
         # ensure at start point
@@ -211,42 +274,67 @@ class Plotter:
 
         self.location=finish
 
-    def _generate_line_pulses(self, steps, rate):
-        x=y=0
-        dx, dy=steps
+    def draw_polyline(self, points, rate):
+        '''Lines through points(a PointArray), stepped as one: the direction is only set
+        where it changes, and the pulses of all the lines are made at once'''
+        logger.info("POLYLINE from {} through {} points".format(str(self.location), len(points)))
+        steps=points.diff(self.location)
+        delay=frequency_to_delay(mm_to_steps(rate))
+        direction=self.direction
+        self.add_blocks(self.pulse_cache.get(
+            ("polyline", steps.x.tobytes(), steps.y.tobytes(), delay, direction),
+            lambda: record_blocks(polyline_records(steps.x, steps.y, delay, direction))))
+        dirx, diry=segment_directions(steps.x, steps.y, direction)
+        self.direction=(bool(dirx[-1]), bool(diry[-1]))
+        self.location=points[-1]
+
+    def move(self, finish, rate, entry, exit):
+        '''Line to finish, speeding up from entry to rate and slowing to exit(see planner.py)'''
+        logger.info("MOVE from {} to {}".format(str(self.location), str(finish)))
+        # Get no. steps to endpoint
+        x, y=self._get_steps_to(finish)
+        # Add the pulse for setting the direction
+        self._set_direction(x >= 0, y >= 0)
+        x, y=abs(x), abs(y)
+        # generate pulses, with a delay for each
+        pulse_count=self._generate_line_pulses((x, y), None, (rate, entry, exit))
+        logger.debug("MOVE generated {} pulses".format(pulse_count))
 
-        fxy=dx - dy
-        delay=frequency_to_delay(rate)
+        self.location=finish
 
-        # -DEBUG-
-        pulse_count=0
-        while((x != dx) or (y != dy)):
-            pulse_count += 1
-            # The endpoint has not been reached
-            # Works along the line in zigzag, going towards 'ideal' until achieved
-            # and then switching to other axis
-            if fxy > 0:
-                self._pulse_steppers(True, False, delay)
-                x += 1
-                fxy -= dy
+    def _generate_line_pulses(self, steps, rate, profile=None):
+        '''Pulses along a line, at rate(steps/s), or with the speeds of profile(rate,
+        entry and exit in mm/s, see planner.py)'''
+        dx, dy=steps
+
+        def generate():
+            if profile is None:
+                delays=frequency_to_delay(rate)
             else:
-                self._pulse_steppers(False, True, delay)
-                y += 1
-                fxy += dx
-        return pulse_count
+                delays=step_delays(dx + dy, *profile)
+            # Works along the line in zigzag, going towards 'ideal' until achieved
+            # and then switching to other axis(all at once, see stepgen.py)
+            return pulse_blocks(line_masks(dx, dy), delays)
+
+        self.add_blocks(self.pulse_cache.get(("line", dx, dy, rate, profile), generate))
+        return dx + dy
 
     def setup_pins(self):
         # Stepper driver pins are outputs
-        self.gpio.init(config.X_DIR, GPIO.MODE_OUTPUT)
-        self.gpio.init(config.Y_DIR, GPIO.MODE_OUTPUT)
-        self.gpio.init(config.X_STEP, GPIO.MODE_OUTPUT)
-        self.gpio.init(config.Y_STEP, GPIO.MODE_OUTPUT)
+        self.gpio.init(config.X_DIR, self.gpio.MODE_OUTPUT)
+        self.gpio.init(config.Y_DIR, self.gpio.MODE_OUTPUT)
+        self.gpio.init(config.X_STEP, self.gpio.MODE_OUTPUT)
+        self.gpio.init(config.Y_STEP, self.gpio.MODE_OUTPUT)
 
         # Set servo to default pen up position.
-        self.gpio.init(config.PEN_SERVO, GPIO.MODE_OUTPUT)
-        self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_UP_PULSE)
+        if config.PEN_SERVO_DMA:
+            self.dma.init_servo(self.gpio, config.PEN_SERVO, config.PEN_UP_PULSE)
+        else:
+            self.gpio.init(config.PEN_SERVO, self.gpio.MODE_OUTPUT)
+            self.pi.set_servo_pulsewidth(config.PEN_SERVO, config.PEN_UP_PULSE)
+        self.pen_down = False
 
         # Disable steppers for now
-        self.gpio.init(config.ENABLE_STEPPER, GPIO.MODE_OUTPUT)
+        self.gpio.init(config.ENABLE_STEPPER, self.gpio.MODE_OUTPUT)
         self.gpio.set(config.ENABLE_STEPPER)
 
@@ -0,0 +1,68 @@
+'''Cache of generated pulse blocks, for moves that are repeated(text, hatching, patterns)'''
+from collections import OrderedDict
+import logging
+import threading
+from drawpi import config
+
+logger = logging.getLogger(__name__)
+
+
+class PulseCache:
+    '''LRU cache of the blocks for a move, keyed by what they depend on: the steps on each
+    axis and the rate(s). Direction is set by its own block, so isn't part of the key.
+    Holds at most limit blocks in all.'''
+
+    def __init__(self, limit=config.PULSE_CACHE_BLOCKS):
+        self.limit = limit
+        # key -> blocks, most recently used last
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generate):
+        '''The blocks for key, from generate() if they aren't cached'''
+        with self.lock:
+            blocks = self.entries.get(key)
+            if blocks is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return blocks
+            self.misses += 1
+        blocks = generate()
+        if len(blocks) <= self.limit:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = blocks
+                    self.size += len(blocks)
+                while self.size > self.limit:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return blocks
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "entries": len(self.entries),
+                "blocks": self.size
+            }
+
+
+_default_cache = None
+
+def default_pulse_cache():
+    '''The cache shared by plotters, so repeated jobs use it too'''
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = PulseCache()
+    return _default_cache
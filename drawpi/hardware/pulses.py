@@ -1,29 +1,220 @@
+'''Compiling commands to pulse images ahead of time, and playing them back
+
+An image is a header, then records of stepgen.PULSE_DTYPE: the pins to set and
+clear, then the delay(us). Pen changes and zeroing need the plotter, so they
+are event records(both masks all set, the delay field says which), done by
+Plotter as the image is played.'''
+import mmap
+import struct
+import zlib
+import numpy as np
+from drawpi import config
 from drawpi.point import Point
+from drawpi.utils import frequency_to_delay, mm_to_steps
+from drawpi.planner import step_delays
+from drawpi.hardware.pulsecache import PulseCache
+from drawpi.hardware.stepgen import (PULSE_DTYPE, direction_masks, goto_masks, line_masks,
+                                     polyline_records, pulse_records, record_blocks,
+                                     segment_directions)
+
+MAGIC = b"JCP1"
+VERSION = 1
+# Magic, version, checksum of the pin config the masks were made for
+HEADER = struct.Struct("<4sII")
+
+EVENT = 0xFFFFFFFF
+EVENT_ZERO = 0
+EVENT_PEN_UP = 1
+EVENT_PEN_DOWN = 2
+
+# Records given to the plotter at a time, when playing
+PLAY_CHUNK = 65536
+
+
+class PulseImageError(Exception):
+    '''Not a pulse image this plotter can play'''
+    pass
+
+
+def pin_checksum():
+    '''Changes if the pins(or their inversion) change, as the masks would be wrong'''
+    pins = (config.X_STEP, config.Y_STEP, config.X_DIR, config.Y_DIR,
+            config.X_INVERTED, config.Y_INVERTED)
+    return zlib.crc32(repr(pins).encode())
+
+
+def _event(code):
+    return np.array([(EVENT, EVENT, code)], dtype=PULSE_DTYPE)
 
 
 class PulseProducer:
+    '''Compiles parsed(and maybe planned) commands to pulse records, as Plotter pulses
+    them, without any hardware. Iterating gives an array of records per command.'''
+
     def __init__(self, commands):
         self.commands = commands
-        self.position = Point(0,0)
+        self.position = Point(0, 0)
+        # Direction the pins were last set to, and whether the pen is down, None when
+        # not known
+        self.direction = None
+        self.pen_down = None
+        self.cache = PulseCache()
 
     def _get_steps_to(self, end):
         diff = end - self.position
         return diff.x, diff.y
 
-    def __iter__():
+    def __iter__(self):
         for command in self.commands:
-            if command["type"] == "line":
-                pulses = line_pulses(position, command["finish"], command["feedrate"]):
-            elif command["type"] == "goto":
-                pulses = goto_pulses(command["finish"])
-            elif command["type"] == "zero":
-                pulses = zero_pulses()
-            elif command["type"] == "pen":
-                pulses = pen_pulses(command["state"])
+            if command.type == "line":
+                records = self.line_pulses(command.finish, mm_to_steps(command.feedrate))
+            elif command.type == "polyline":
+                records = self.polyline_pulses(command.points, command.feedrate)
+            elif command.type == "move":
+                records = self.line_pulses(command.finish, None, (command.rate, command.entry, command.exit))
+            elif command.type == "goto":
+                records = self.goto_pulses(command.finish)
+            elif command.type == "zero":
+                records = self.zero_pulses()
+            elif command.type == "pen":
+                records = self.pen_pulses(command.state)
             else:
-                raise Exception
-            for pulse in pulses:
-                yield pulse
+                raise ValueError("Can't compile a {} command".format(command.type))
+            yield records
+
+    def _direction(self, x, y):
+        # Nothing, if it hasn't changed
+        if self.direction == (x >= 0, y >= 0):
+            return np.zeros(0, dtype=PULSE_DTYPE)
+        self.direction = (x >= 0, y >= 0)
+        set_mask, clear_mask = direction_masks(x >= 0, y >= 0)
+        return np.array([(set_mask, clear_mask, 0)], dtype=PULSE_DTYPE)
+
+    def line_pulses(self, end, rate, profile=None):
+        '''As Plotter.draw_line(at rate steps/s) or Plotter.move(with profile)'''
+        x, y = self._get_steps_to(end)
+        self.position = end
+        dx, dy = abs(x), abs(y)
+
+        def generate():
+            delays = frequency_to_delay(rate) if profile is None else step_delays(dx + dy, *profile)
+            return pulse_records(line_masks(dx, dy), delays)
+
+        return np.concatenate((self._direction(x, y),
+                               self.cache.get(("line", dx, dy, rate, profile), generate)))
+
+    def polyline_pulses(self, points, feedrate):
+        '''As Plotter.draw_polyline'''
+        steps = points.diff(self.position)
+        delay = frequency_to_delay(mm_to_steps(feedrate))
+        direction = self.direction
+        records = self.cache.get(
+            ("polyline", steps.x.tobytes(), steps.y.tobytes(), delay, direction),
+            lambda: polyline_records(steps.x, steps.y, delay, direction))
+        dirx, diry = segment_directions(steps.x, steps.y, direction)
+        self.direction = (bool(dirx[-1]), bool(diry[-1]))
+        self.position = points[-1]
+        return records
+
+    def goto_pulses(self, end):
+        '''As Plotter.goto'''
+        x, y = self._get_steps_to(end)
+        self.position = end
+        dx, dy = abs(x), abs(y)
+        delay = frequency_to_delay(mm_to_steps(config.GOTO_RATE))
+        return np.concatenate((self._direction(x, y), self.cache.get(
+            ("goto", dx, dy, delay), lambda: pulse_records(goto_masks(dx, dy), delay))))
+
+    def zero_pulses(self):
+        # Zeroing stops at the endstops, so is left to the plotter
+        self.position = Point(0, 0)
+        self.direction = None
+        return _event(EVENT_ZERO)
+
+    def pen_pulses(self, state):
+        # Nothing, if it's already there
+        if self.pen_down == state:
+            return np.zeros(0, dtype=PULSE_DTYPE)
+        self.pen_down = state
+        return _event(EVENT_PEN_DOWN if state else EVENT_PEN_UP)
+
+
+def compile_image(commands, f):
+    '''Write the pulse image of parsed commands to a binary file object, returning the
+    number of records'''
+    f.write(HEADER.pack(MAGIC, VERSION, pin_checksum()))
+    count = 0
+    for records in PulseProducer(commands):
+        f.write(records.tobytes())
+        count += len(records)
+    return count
+
+
+class PulseImage:
+    '''A pulse image, mapped into memory'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise PulseImageError("Too short for a pulse image")
+        magic, version, pins = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise PulseImageError("Not a version {} pulse image".format(VERSION))
+        if pins != pin_checksum():
+            raise PulseImageError("Image was compiled for different pins")
+        if (len(self.mmap) - HEADER.size) % PULSE_DTYPE.itemsize:
+            raise PulseImageError("Image ends part way through a record")
+
+    def array(self):
+        '''The records, without copying. Must be deleted before closing.'''
+        return np.frombuffer(self.mmap, dtype=PULSE_DTYPE, offset=HEADER.size)
+
+    def __len__(self):
+        return (len(self.mmap) - HEADER.size) // PULSE_DTYPE.itemsize
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load(path):
+    return PulseImage(path)
+
 
-    def line_pulses(end, feedrate):
-    
\ No newline at end of file
+def play(image, plotter=None):
+    '''Feed a PulseImage to the plotter's DMA, doing its events as they come'''
+    own_plotter = plotter is None
+    if own_plotter:
+        from drawpi.hardware.plotter import Plotter
+        plotter = Plotter()
+    records = image.array()
+    try:
+        events = np.flatnonzero((records["set"] == EVENT) & (records["clear"] == EVENT)).tolist()
+        start = 0
+        for end in events + [len(records)]:
+            for chunk in range(start, end, PLAY_CHUNK):
+                plotter.add_blocks(record_blocks(records[chunk:min(end, chunk + PLAY_CHUNK)]))
+            if end < len(records):
+                # The image has set the direction pins without the plotter knowing
+                plotter.direction = None
+                code = records["delay"][end]
+                if code == EVENT_ZERO:
+                    plotter.zero_me()
+                elif code == EVENT_PEN_DOWN:
+                    plotter.pendown()
+                else:
+                    plotter.penup()
+            start = end + 1
+        plotter.wait_till_idle()
+    finally:
+        del records
+        plotter.stop()
+        if own_plotter:
+            plotter.close()
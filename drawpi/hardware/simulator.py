@@ -0,0 +1,262 @@
+'''Stand-ins for the GPIO, DMA and pigpio, so jobs can be run through Plotter without
+a plotter, to find out how long they take and what they need'''
+from collections import deque
+from contextlib import contextmanager
+import logging
+import threading
+from drawpi import config
+from drawpi.decode import PlotterParser
+from drawpi.hardware.plotter import Plotter
+from drawpi.hardware.controlblocks import CONTROL_BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# As DMAGPIO
+BLOCK_NUMBER = 983040
+# Report entries that are only upper bounds(see Simulation)
+UPPER_BOUNDS = ("peak_queue", "peak_dma_blocks", "dma_memory")
+
+# Threads running a simulation. The plotter's info and debug logging from them is left
+# out, as it would look like a real job's(warnings are kept).
+_simulating = set()
+
+
+class _SimulationFilter(logging.Filter):
+    def filter(self, record):
+        return record.thread not in _simulating or record.levelno >= logging.WARNING
+
+
+logging.getLogger(Plotter.__module__).addFilter(_SimulationFilter())
+
+
+@contextmanager
+def _quiet_plotter():
+    thread = threading.get_ident()
+    _simulating.add(thread)
+    try:
+        yield
+    finally:
+        _simulating.discard(thread)
+
+
+class Simulation:
+    '''The state of the simulated plotter, shared by the stand-ins, and what the job used.
+
+    The DMA runs everything it has been given whenever it is asked whether it is
+    active(stopping early at an endstop), so a job is treated as generating pulses
+    infinitely fast. Time is the sum of the delays the DMA runs, plus sleeps while it
+    is idle. The pen moving is the delays straight after a servo block, or those sleeps.
+
+    As nothing is run until the plotter waits for the DMA(zeroing, or the end of the
+    job, now the pen doesn't wait for it), the peak queue and DMA use are upper bounds:
+    what the job needs if pulses are generated faster than the DMA runs them.'''
+
+    def __init__(self):
+        self.gpio = SimulatedGPIO(self)
+        self.dma = SimulatedDMA(self)
+        self.pi = SimulatedPi(self)
+        # Position of the carriage, in steps
+        self.x = 0
+        self.y = 0
+        # Set when the carriage reaches an endstop
+        self.reached_endstop = False
+        self.pen_down = False
+        # Set while the delays run are the pen moving
+        self.settling = False
+        # Counts for the report
+        self.pulses = 0
+        self.x_steps = 0
+        self.y_steps = 0
+        self.control_blocks = 0
+        self.draw_time = 0
+        self.travel_time = 0
+        self.pen_time = 0
+        self.pen_lifts = 0
+        self.peak_queue = 0
+        self.peak_dma_blocks = 0
+
+    def plotter(self):
+        return Plotter(gpio=self.gpio, dma=self.dma, pi=self.pi, sleep=self.sleep)
+
+    def sleep(self, seconds):
+        # Sleeping while the DMA runs doesn't make the job any longer
+        if not self.dma.active:
+            self.pen_time += seconds
+
+    def set_pen(self, pin, width):
+        if pin == config.PEN_SERVO:
+            down = width == config.PEN_DOWN_PULSE
+            if self.pen_down and not down:
+                self.pen_lifts += 1
+            self.pen_down = down
+
+    def endstop(self, pin):
+        '''Whether the endstop on the pin is pressed'''
+        return (pin == config.X_MIN and self.x <= 0) or (pin == config.Y_MIN and self.y <= 0)
+
+    def execute(self, block):
+        '''Run a control block'''
+        self.control_blocks += 1
+        if len(block) == 1:
+            # Delays are in us
+            if self.settling:
+                self.pen_time += block[0] / 1e6
+            elif self.pen_down:
+                self.draw_time += block[0] / 1e6
+            else:
+                self.travel_time += block[0] / 1e6
+            return
+        if len(block) == 3:
+            _, pin, width = block
+            self.set_pen(pin, width)
+            self.settling = True
+            return
+        self.settling = False
+        set_mask, clear_mask = block
+        # Rising edges step the motors, in the direction the pins give
+        stepped = set_mask & ~self.gpio.levels
+        self.gpio.levels = (self.gpio.levels | set_mask) & ~clear_mask
+        if stepped & ((1 << config.X_STEP) | (1 << config.Y_STEP)):
+            self.pulses += 1
+        if stepped & (1 << config.X_STEP):
+            self.x_steps += 1
+            self.x += 1 if (self.gpio.levels >> config.X_DIR & 1) != config.X_INVERTED else -1
+            self.reached_endstop |= self.x == 0
+        if stepped & (1 << config.Y_STEP):
+            self.y_steps += 1
+            self.y += 1 if (self.gpio.levels >> config.Y_DIR & 1) != config.Y_INVERTED else -1
+            self.reached_endstop |= self.y == 0
+
+    def report(self):
+        return {
+            "pulses": self.pulses,
+            "x_steps": self.x_steps,
+            "y_steps": self.y_steps,
+            "control_blocks": self.control_blocks,
+            "draw_time": self.draw_time,
+            "travel_time": self.travel_time,
+            "pen_time": self.pen_time,
+            "total_time": self.draw_time + self.travel_time + self.pen_time,
+            "pen_lifts": self.pen_lifts,
+            "peak_queue": self.peak_queue,
+            "peak_dma_blocks": self.peak_dma_blocks,
+            "dma_memory": self.peak_dma_blocks * CONTROL_BLOCK_SIZE
+        }
+
+
+class SimulatedGPIO:
+    MODE_OUTPUT = 1
+    MODE_INPUT_NOPULL = 2
+    MODE_INPUT_PULLUP = 3
+    MODE_INPUT_PULLDOWN = 4
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        # Bitmask of the pins that are high
+        self.levels = 0
+
+    def init(self, pin, mode):
+        pass
+
+    def set(self, pin):
+        self.levels |= 1 << pin
+
+    def clear(self, pin):
+        self.levels &= ~(1 << pin)
+
+    def read(self, pin):
+        if pin == config.X_MIN or pin == config.Y_MIN:
+            inverted = config.X_END_INVERTED if pin == config.X_MIN else config.Y_END_INVERTED
+            # The plotter sees a pressed endstop as (read == 1) == inverted
+            return int(self.simulation.endstop(pin) == inverted)
+        return self.levels >> pin & 1
+
+
+class SimulatedDMA:
+    '''DMAGPIO's queue, feeding a ring of BLOCK_NUMBER control blocks'''
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.blocks_queue = deque()
+        # Blocks in DMA memory, not yet run
+        self.ring = deque()
+        # What is_active last said
+        self.active = False
+
+    def init_servo(self, gpio, pin, width):
+        self.simulation.set_pen(pin, width)
+
+    def set_servo(self, width):
+        self.simulation.set_pen(config.PEN_SERVO, width)
+
+    def add_pulses(self, blocks):
+        self.blocks_queue.extend(blocks)
+        self.simulation.peak_queue = max(self.simulation.peak_queue, len(self.blocks_queue))
+
+    def update(self, drain=False, limit=None):
+        number = min(BLOCK_NUMBER - len(self.ring), len(self.blocks_queue))
+        if limit is not None:
+            number = min(number, limit)
+        for _ in range(number):
+            self.ring.append(self.blocks_queue.popleft())
+        self.simulation.peak_dma_blocks = max(self.simulation.peak_dma_blocks, len(self.ring))
+
+    def is_active(self):
+        self.active = bool(self.ring)
+        # It has had time to run everything, up to an endstop(which zeroing would see,
+        # and stop at)
+        simulation = self.simulation
+        while self.ring:
+            simulation.execute(self.ring.popleft())
+            if simulation.reached_endstop:
+                simulation.reached_endstop = False
+                break
+        return self.active
+
+    def stop(self):
+        # Whatever hadn't been run never will be
+        self.ring.clear()
+        self.blocks_queue.clear()
+
+
+class SimulatedPi:
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+    def set_servo_pulsewidth(self, pin, width):
+        self.simulation.set_pen(pin, width)
+
+    def stop(self):
+        pass
+
+
+def simulate(parsed, simplify=None, plan=False):
+    '''Run parsed commands(as runner.run does) on a simulated plotter, returning a report
+    of what the job needs: pulses, time(s), pen lifts, peak queue and DMA use(blocks, bytes,
+    upper bounds)'''
+    from drawpi.runner import run
+    simulation = Simulation()
+    with _quiet_plotter():
+        run(parsed, simplify, plotter=simulation.plotter(), plan=plan)
+    return simulation.report()
+
+
+def simulate_image(image):
+    '''simulate, for a compiled PulseImage'''
+    from drawpi.hardware.pulses import play
+    simulation = Simulation()
+    with _quiet_plotter():
+        play(image, simulation.plotter())
+    return simulation.report()
+
+
+def dry_run(commands, simplify=None, plan=False):
+    '''simulate, for JCode given as text or an iterable of lines'''
+    return simulate(PlotterParser(commands), simplify, plan)
+
+
+def log_report(report):
+    '''Log a report, one entry per line'''
+    for name, value in report.items():
+        logger.info("{}: {}{}".format(name, round(value, 3),
+                                      " (upper bound)" if name in UPPER_BOUNDS else ""))
@@ -0,0 +1,175 @@
+'''Step generation for whole lines at once, with numpy'''
+import numpy as np
+from drawpi import config
+
+X_STEP_MASK = 1 << config.X_STEP
+Y_STEP_MASK = 1 << config.Y_STEP
+
+# A pulse(as Plotter.add_pulse takes them): pins to set, pins to clear, then the delay(us)
+PULSE_DTYPE = np.dtype([("set", "<u4"), ("clear", "<u4"), ("delay", "<u4")])
+
+
+def direction_masks(dirx, diry):
+    '''(set, clear) masks of the direction pins, for moving forward on each axis or not'''
+    set_mask = clear_mask = 0
+    if dirx != config.X_INVERTED:
+        set_mask |= 1 << config.X_DIR
+    else:
+        clear_mask |= 1 << config.X_DIR
+    if diry != config.Y_INVERTED:
+        set_mask |= 1 << config.Y_DIR
+    else:
+        clear_mask |= 1 << config.Y_DIR
+    return set_mask, clear_mask
+
+
+def line_steps(dx, dy):
+    '''Which axis each pulse of a line(dx, dy >= 0 steps) moves, True for x.
+
+    The same zigzag as stepping along one pulse at a time, with error dx - dy:
+    x step a comes at (a + 1) * dy and y step b at (b + 1) * dx, y first on a tie.
+    So y step b comes after min(dx, ((b + 1) * dx - 1) // dy) x steps.'''
+    is_x = np.ones(dx + dy, dtype=bool)
+    if dy:
+        b = np.arange(dy, dtype=np.int64)
+        is_x[b + np.minimum(dx, ((b + 1) * dx - 1) // dy)] = False
+    return is_x
+
+
+def line_masks(dx, dy):
+    '''The step pins pulsed for each pulse of a line'''
+    return np.where(line_steps(dx, dy), X_STEP_MASK, Y_STEP_MASK)
+
+
+def polyline_masks(dx, dy):
+    '''line_masks of each segment of a polyline(arrays of dx, dy >= 0 steps), one after
+    the other, all at once'''
+    dx = np.asarray(dx, dtype=np.int64)
+    dy = np.asarray(dy, dtype=np.int64)
+    # First pulse of each segment, and of each segment's y steps
+    offsets = np.concatenate(([0], np.cumsum(dx + dy)[:-1]))
+    y_offsets = np.concatenate(([0], np.cumsum(dy)[:-1]))
+    is_x = np.ones(int(np.sum(dx + dy)), dtype=bool)
+    segment = np.repeat(np.arange(len(dy)), dy)
+    b = np.arange(len(segment)) - y_offsets[segment]
+    sx, sy = dx[segment], dy[segment]
+    # As line_steps, but (-1 // dy) for a segment without x steps must stay in the segment
+    is_x[offsets[segment] + b + np.clip(((b + 1) * sx - 1) // sy, 0, sx)] = False
+    return np.where(is_x, X_STEP_MASK, Y_STEP_MASK)
+
+
+def segment_directions(steps_x, steps_y, direction=None):
+    '''Whether each segment of a polyline(signed steps) goes forward on each axis. An axis
+    a segment doesn't move keeps the direction it had(direction, at the start).'''
+    initial = direction if direction is not None else (True, True)
+    directions = []
+    for steps, forward in zip((steps_x, steps_y), initial):
+        steps = np.asarray(steps)
+        # The last segment, up to each, that moved on the axis
+        moved = np.where(steps != 0, np.arange(len(steps)), -1)
+        np.maximum.accumulate(moved, out=moved)
+        directions.append(np.where(moved >= 0, steps[moved] > 0, forward))
+    return directions
+
+
+def polyline_records(steps_x, steps_y, delays, direction=None):
+    '''Pulse records of a polyline(signed steps of each segment), with a direction record
+    wherever the direction changes from the last(direction at the start, None if not known)'''
+    dirx, diry = segment_directions(steps_x, steps_y, direction)
+    pulses = np.abs(steps_x).astype(np.int64) + np.abs(steps_y)
+    masks = polyline_masks(np.abs(steps_x), np.abs(steps_y))
+    delays = np.broadcast_to(np.asarray(delays, dtype=np.int64), masks.shape)
+    offsets = np.concatenate(([0], np.cumsum(pulses)))
+    changes = np.flatnonzero((dirx[1:] != dirx[:-1]) | (diry[1:] != diry[:-1])) + 1
+    if len(dirx) and (direction is None or direction != (dirx[0], diry[0])):
+        changes = np.concatenate(([0], changes))
+    # The pulses before the first change, then each change with the pulses up to the next
+    bounds = np.concatenate(([0], offsets[changes], [offsets[-1]])).tolist()
+    parts = [pulse_records(masks[:bounds[1]], delays[:bounds[1]])]
+    for i, segment in enumerate(changes.tolist()):
+        set_mask, clear_mask = direction_masks(dirx[segment], diry[segment])
+        parts.append(np.array([(set_mask, clear_mask, 0)], dtype=PULSE_DTYPE))
+        parts.append(pulse_records(masks[bounds[i + 1]:bounds[i + 2]], delays[bounds[i + 1]:bounds[i + 2]]))
+    return np.concatenate(parts)
+
+
+def goto_masks(dx, dy):
+    '''The step pins pulsed for each pulse of a goto, both axes together(as Plotter.goto
+    always has, each axis stepping one less than asked)'''
+    pulse = np.arange(max(dx, dy))
+    return np.where(pulse < dx - 1, X_STEP_MASK, 0) | np.where(pulse < dy - 1, Y_STEP_MASK, 0)
+
+
+def pulse_records(masks, delays, merge=config.MERGE_PULSES):
+    '''Pulses of the pins in masks: the pins set and half the delay(us), then the pins
+    cleared and the other half.
+
+    With merge, a pulse that shares no pins with the next isn't cleared until the next
+    is set, by the same record, so it is a single record with the whole delay. The
+    pins rise at the same times either way.'''
+    masks = np.asarray(masks, dtype=np.uint32)
+    delays = np.broadcast_to(np.asarray(delays, dtype=np.int64), masks.shape)
+    if not merge:
+        records = np.zeros(2 * len(masks), dtype=PULSE_DTYPE)
+        records["set"][0::2] = masks
+        records["delay"][0::2] = delays // 2
+        records["clear"][1::2] = masks
+        records["delay"][1::2] = (delays + 1) // 2
+        return records
+    # Whether each pulse is cleared by the set of the next
+    merged = np.zeros(len(masks), dtype=bool)
+    merged[:-1] = (masks[:-1] & masks[1:]) == 0
+    starts = np.zeros(len(masks), dtype=np.int64)
+    np.cumsum(np.where(merged, 1, 2)[:-1], out=starts[1:])
+    records = np.zeros(len(masks) + np.count_nonzero(~merged), dtype=PULSE_DTYPE)
+    records["set"][starts] = masks
+    records["clear"][starts[1:]] = np.where(merged[:-1], masks[:-1], 0)
+    records["delay"][starts] = np.where(merged, delays, delays // 2)
+    clears = starts[~merged] + 1
+    records["clear"][clears] = masks[~merged]
+    records["delay"][clears] = (delays[~merged] + 1) // 2
+    return records
+
+
+def record_blocks(records):
+    '''The blocks DMAGPIO takes for pulse records: (set, clear) then (delay,), leaving
+    out delays of 0'''
+    has_delay = records["delay"] != 0
+    # Where each record's (set, clear) block goes
+    starts = np.arange(len(records))
+    starts[1:] += np.cumsum(has_delay[:-1])
+    blocks = np.empty(len(records) + np.count_nonzero(has_delay), dtype=object)
+    # Blocks are tuples shared between the pulses that have them, picked by index
+    masks = records["set"].astype(np.uint64) << np.uint64(32) | records["clear"]
+    values, index = np.unique(masks, return_inverse=True)
+    blocks[starts] = _shared([(m >> 32, m & 0xFFFFFFFF) for m in values.tolist()])[index]
+    values, index = np.unique(records["delay"][has_delay], return_inverse=True)
+    blocks[starts[has_delay] + 1] = _shared([(d,) for d in values.tolist()])[index]
+    return blocks.tolist()
+
+
+def pulse_blocks(masks, delays, merge=config.MERGE_PULSES):
+    '''Blocks(as Plotter.add_pulse makes them) for pulses of the pins in masks, the same
+    as record_blocks(pulse_records(masks, delays, merge))'''
+    if merge:
+        return record_blocks(pulse_records(masks, delays, merge))
+    # Unmerged, every pulse is 4 blocks(its delays are never 0, as they're at least 2us),
+    # so they can be interleaved more quickly
+    masks = np.asarray(masks)
+    delays = np.broadcast_to(np.asarray(delays, dtype=np.int64), masks.shape)
+    blocks = [None] * (4 * len(masks))
+    values, index = np.unique(masks, return_inverse=True)
+    blocks[0::4] = _shared([(m, 0) for m in values.tolist()])[index].tolist()
+    blocks[2::4] = _shared([(0, m) for m in values.tolist()])[index].tolist()
+    for start, half in ((1, delays // 2), (3, (delays + 1) // 2)):
+        values, index = np.unique(half, return_inverse=True)
+        blocks[start::4] = _shared([(d,) for d in values.tolist()])[index].tolist()
+    return blocks
+
+
+def _shared(tuples):
+    '''An object array of the tuples, to index'''
+    array = np.empty(len(tuples), dtype=object)
+    for i, block in enumerate(tuples):
+        array[i] = block
+    return array
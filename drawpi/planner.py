@@ -0,0 +1,122 @@
+'''Acceleration planning: lines and gotos become moves with trapezoidal speed profiles
+
+Speeds are in mm/s, with a step on either axis counting as 1/STEPS_MM mm(as the
+plotter's constant rate pulses always have). Consecutive lines are planned
+together, so corners are taken as fast as the junction deviation allows.'''
+from collections import namedtuple
+import math
+import numpy as np
+import drawpi.config as config
+from drawpi.point import Point
+
+
+class Move(namedtuple("Move", ["finish", "rate", "entry", "exit"])):
+    '''A line to finish at up to rate, entered and left at the given speeds'''
+    __slots__ = ()
+    type = "move"
+
+
+def junction_speed(previous, following, acceleration=config.ACCELERATION,
+                   deviation=config.JUNCTION_DEVIATION):
+    '''Max speed through the corner between 2 moves(given as steps), the speed whose
+    centripetal acceleration, round an arc deviation from the corner, is acceleration'''
+    cos_theta = -(previous[0] * following[0] + previous[1] * following[1]) / (
+        math.hypot(*previous) * math.hypot(*following))
+    sin_half = math.sqrt(max(0.5 * (1 - cos_theta), 0))
+    if sin_half >= 1:
+        # Straight on
+        return math.inf
+    return math.sqrt(acceleration * deviation * sin_half / (1 - sin_half))
+
+
+def step_delays(pulses, rate, entry, exit, acceleration=config.ACCELERATION):
+    '''The delay(us) after each pulse of a move, accelerating from entry to rate and
+    decelerating to exit in time'''
+    # Distance(mm) to the middle of each pulse
+    distance = (np.arange(pulses) + 0.5) / config.STEPS_MM
+    length = pulses / config.STEPS_MM
+    speed = np.minimum(np.sqrt(entry ** 2 + 2 * acceleration * distance),
+                       np.sqrt(exit ** 2 + 2 * acceleration * (length - distance)))
+    speed = np.minimum(speed, rate)
+    return np.rint(1e6 / (speed * config.STEPS_MM)).astype(np.int64)
+
+
+class _Segment:
+    __slots__ = ("finish", "rate", "length", "steps", "max_entry")
+
+    def __init__(self, start, finish, rate):
+        self.finish = finish
+        self.rate = rate
+        self.steps = (finish.x - start.x, finish.y - start.y)
+        # As pulses are counted
+        self.length = (abs(self.steps[0]) + abs(self.steps[1])) / config.STEPS_MM
+        self.max_entry = min(config.START_RATE, rate)
+
+
+def plan_speeds(segments, entry, exit, acceleration=config.ACCELERATION):
+    '''Speeds at the start of each segment, and at the end of the last, given those at
+    the very start and end'''
+    speeds = [0] * (len(segments) + 1)
+    speeds[0] = entry
+    speeds[-1] = exit
+    # Backward, so each can slow down in time for the next
+    for i in range(len(segments) - 1, 0, -1):
+        speeds[i] = min(segments[i].max_entry,
+                        math.sqrt(speeds[i + 1] ** 2 + 2 * acceleration * segments[i].length))
+    # Forward, so each can speed up in time
+    for i in range(1, len(segments)):
+        speeds[i] = min(speeds[i],
+                        math.sqrt(speeds[i - 1] ** 2 + 2 * acceleration * segments[i - 1].length))
+    return speeds
+
+
+def plan(commands, position=Point(0, 0), acceleration=config.ACCELERATION,
+         deviation=config.JUNCTION_DEVIATION, lookahead=config.PLANNER_LOOKAHEAD):
+    '''Replace the lines and gotos of parsed commands with Moves. Runs of lines are
+    planned lookahead at a time, at least, with the rest of the stream passed through.'''
+    chain = []
+    # Speed at the start of the chain
+    entry = None
+    for command in commands:
+        if command.type == "line":
+            segment = _Segment(position, command.finish, command.feedrate)
+            position = command.finish
+            if segment.length == 0:
+                continue
+            if not chain:
+                entry = segment.max_entry
+            else:
+                previous = chain[-1]
+                segment.max_entry = max(
+                    min(config.START_RATE, previous.rate, segment.rate),
+                    min(previous.rate, segment.rate,
+                        junction_speed(previous.steps, segment.steps, acceleration, deviation)))
+            chain.append(segment)
+            if len(chain) >= 2 * lookahead:
+                # The first half of the chain won't change with what comes later
+                speeds = plan_speeds(chain, entry, min(config.START_RATE, segment.rate), acceleration)
+                for i in range(lookahead):
+                    yield Move(chain[i].finish, chain[i].rate, speeds[i], speeds[i + 1])
+                entry = speeds[lookahead]
+                del chain[:lookahead]
+            continue
+        yield from _finish_chain(chain, entry, acceleration)
+        chain = []
+        if command.type == "goto":
+            rest = min(config.START_RATE, config.TRAVEL_RATE)
+            if command.finish != position:
+                yield Move(command.finish, config.TRAVEL_RATE, rest, rest)
+            position = command.finish
+        else:
+            if command.type == "zero":
+                position = Point(0, 0)
+            yield command
+    yield from _finish_chain(chain, entry, acceleration)
+
+
+def _finish_chain(chain, entry, acceleration):
+    '''Moves for the rest of a chain, coming to rest at the end'''
+    if chain:
+        speeds = plan_speeds(chain, entry, min(config.START_RATE, chain[-1].rate), acceleration)
+        for i, segment in enumerate(chain):
+            yield Move(segment.finish, segment.rate, speeds[i], speeds[i + 1])
@@ -1,54 +1,133 @@
 '''Class Point, for easy representaion and manipulation'''
-import drawpi.utils as utils
+from operator import itemgetter
+import numpy as np
+import drawpi.config as config
 
-class Point:
-    def __init__(self, x, y, unit='mm'):
+# Builds a Point from steps, without going through Point.__new__
+_new = tuple.__new__
+
+
+class Point(tuple):
+    '''An immutable (x, y) in steps. Hashable, and equal to any point(or tuple) with the
+    same steps.'''
+    __slots__ = ()
+
+    def __new__(cls, x, y, unit='mm'):
         # Initialise as either mm or steps
         # Internally stored as steps
         if unit == 'mm':
-            self.x = utils.mm_to_steps(x)
-            self.y = utils.mm_to_steps(y)
-        else:
-            self.x = x
-            self.y = y
+            # utils.mm_to_steps, inlined as points are made for every command
+            return _new(cls, (round(x * config.STEPS_MM), round(y * config.STEPS_MM)))
+        return _new(cls, (x, y))
+
+    @classmethod
+    def from_steps(cls, x, y):
+        '''The point at x, y steps(the quickest way to make one)'''
+        return _new(cls, (x, y))
+
+    x = property(itemgetter(0), doc="x in steps")
+    y = property(itemgetter(1), doc="y in steps")
 
-    
     @property
     def x_mm(self):
         '''Calculate x in millimetres'''
-        return utils.steps_to_mm(self.x)
-
-    @x_mm.setter
-    def x_mm(self, value):
-        self.x = utils.mm_to_steps(value)
+        return self[0] / config.STEPS_MM
 
     @property
     def y_mm(self):
         '''Calculate y in millimetres'''
-        return utils.steps_to_mm(self.y)
-
-    @y_mm.setter
-    def y_mm(self, value):
-        self.y = utils.mm_to_steps(value)
+        return self[1] / config.STEPS_MM
 
     def __add__(self, other):
         '''Add 2 points, returning the new point'''
-        return Point(self.x + other.x, self.y + other.y, unit="steps")
+        return _new(Point, (self[0] + other[0], self[1] + other[1]))
 
     def __sub__(self, other):
         '''Subtract 2 points, returning the new point'''
-        return Point(self.x - other.x, self.y - other.y, unit="steps")
+        return _new(Point, (self[0] - other[0], self[1] - other[1]))
+
     def __str__(self):
         '''Convert point to str representation'''
-        return "Point({}, {})".format(self.x, self.y)
+        return "Point({}, {})".format(self[0], self[1])
+
     def __repr__(self):
         '''Convert point to str representation'''
-        return "Point({}, {})".format(self.x, self.y)
+        return "Point({}, {})".format(self[0], self[1])
+
     def __format__(self, spec):
         return self.__repr__()
 
+    def __getnewargs__(self):
+        # For pickle and copy, which would otherwise pass the tuple as x
+        return (self[0], self[1], 'steps')
+
+
+class PointArray:
+    '''Many points, as int32 arrays of x and y steps'''
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y, unit='mm'):
+        if unit == 'mm':
+            x = np.rint(np.asarray(x, dtype=np.float64) * config.STEPS_MM)
+            y = np.rint(np.asarray(y, dtype=np.float64) * config.STEPS_MM)
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+
+    @classmethod
+    def from_points(cls, points):
+        '''From an iterable of Points'''
+        xy = np.array(list(points), dtype=np.int32).reshape(-1, 2)
+        return cls(xy[:, 0], xy[:, 1], unit='steps')
+
+    @property
+    def x_mm(self):
+        return self.x / config.STEPS_MM
+
+    @property
+    def y_mm(self):
+        return self.y / config.STEPS_MM
+
+    def diff(self, start=None):
+        '''Steps from each point to the next(from start to the first, if given)'''
+        if start is None:
+            return PointArray(np.diff(self.x), np.diff(self.y), unit='steps')
+        return PointArray(np.diff(self.x, prepend=start[0]), np.diff(self.y, prepend=start[1]),
+                          unit='steps')
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return _new(Point, (int(self.x[index]), int(self.y[index])))
+        return PointArray(self.x[index], self.y[index], unit='steps')
+
+    def __iter__(self):
+        for x, y in zip(self.x.tolist(), self.y.tolist()):
+            yield _new(Point, (x, y))
+
+    def __add__(self, other):
+        '''Add a Point, or the points of another PointArray'''
+        x, y = _xy(other)
+        return PointArray(self.x + x, self.y + y, unit='steps')
+
+    def __sub__(self, other):
+        '''Subtract a Point, or the points of another PointArray'''
+        x, y = _xy(other)
+        return PointArray(self.x - x, self.y - y, unit='steps')
+
     def __eq__(self, other):
-        if isinstance(other, Point):
-            if self.x == other.x and self.y == other.y:
-                return True
-        return False
+        if isinstance(other, PointArray):
+            return np.array_equal(self.x, other.x) and np.array_equal(self.y, other.y)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "PointArray({} points)".format(len(self))
+
+
+def _xy(other):
+    if isinstance(other, PointArray):
+        return other.x, other.y
+    return other[0], other[1]
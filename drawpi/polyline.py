@@ -0,0 +1,33 @@
+'''Runs of lines, joined into polylines so their pulses are made together'''
+from collections import namedtuple
+import drawpi.config as config
+from drawpi.point import PointArray
+
+
+class Polyline(namedtuple("Polyline", ["points", "feedrate"])):
+    '''Lines through points(a PointArray), from wherever the plotter is'''
+    __slots__ = ()
+    type = "polyline"
+
+
+def join_lines(commands, limit=config.POLYLINE_SEGMENTS):
+    '''Replace runs of line commands at one feedrate, in a stream of parsed commands, with
+    Polylines of up to limit segments'''
+    run = []
+    for command in commands:
+        if run and (command.type != "line" or command.feedrate != run[0].feedrate
+                    or len(run) >= limit):
+            yield _join_run(run)
+            run = []
+        if command.type == "line":
+            run.append(command)
+        else:
+            yield command
+    if run:
+        yield _join_run(run)
+
+
+def _join_run(run):
+    if len(run) == 1:
+        return run[0]
+    return Polyline(PointArray.from_points([c.finish for c in run]), run[0].feedrate)
@@ -2,19 +2,30 @@
 import logging
 import sys
 from drawpi.decode import PlotterParser
+from drawpi.simplify import simplify_commands
+from drawpi.planner import plan as plan_moves
+from drawpi.polyline import join_lines
 from drawpi.hardware.plotter import Plotter
 
 def execute_line(command, plotter:Plotter):
     '''Line is slower and prettier.'''
-    plotter.draw_line(plotter.location, command["finish"], command["feedrate"])
+    plotter.draw_line(plotter.location, command.finish, command.feedrate)
+
+def execute_polyline(command, plotter:Plotter):
+    '''Lines one after the other, stepped together'''
+    plotter.draw_polyline(command.points, command.feedrate)
 
 def execute_goto(command, plotter:Plotter):
     '''Goto is fast and not pretty'''
-    plotter.goto(command["finish"])
+    plotter.goto(command.finish)
+
+def execute_move(command, plotter:Plotter):
+    '''A planned line or goto, with acceleration'''
+    plotter.move(command.finish, command.rate, command.entry, command.exit)
 
 def execute_pen(command, plotter:Plotter):
     '''Run a pen change command'''
-    if not command["state"]:
+    if not command.state:
         plotter.penup()
     else:
         plotter.pendown()
@@ -28,6 +39,8 @@ def execute_zero(command, plotter:Plotter):
 COMMANDS = {
     "goto": execute_goto,
     "line": execute_line,
+    "polyline": execute_polyline,
+    "move": execute_move,
     "zero": execute_zero,
     "pen": execute_pen
 }
@@ -37,19 +50,41 @@ def setup_logging(verbose=False):
     level = logging.DEBUG if verbose else logging.INFO
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S", level=level)
 
-def main(commands):
+def main(commands, simplify=None, plan=False):
+    '''Draw JCode, given as text or as an iterable of lines(which is consumed lazily).
+    Runs of lines are simplified on the step grid, to within simplify steps, if given.'''
     # Initialise command parser(parses jcode)
-    parser = PlotterParser(commands)
-    # Initialise the plotter, steppers etc.
-    plotter = Plotter()
-    parsed = list(parser)
-    # Run commands, one by one, according to the appropriate function.
+    run(PlotterParser(commands), simplify, plan=plan)
+
+def prepare(parsed, simplify=None, plan=False):
+    '''Parsed commands as they are drawn: simplified to within simplify steps, if given,
+    and with lines and gotos planned with acceleration(see planner.py) if plan, or
+    runs of lines joined into polylines if not'''
+    if simplify is not None:
+        parsed = simplify_commands(parsed, simplify)
+    if plan:
+        parsed = plan_moves(parsed)
+    else:
+        parsed = join_lines(parsed)
+    return parsed
+
+def run(parsed, simplify=None, plotter=None, plan=False):
+    '''Draw parsed commands(from PlotterParser, or a binary JCode file), prepared as
+    prepare does'''
+    parsed = prepare(parsed, simplify, plan)
+    # Initialise the plotter, steppers etc.(closed after, if it is made here)
+    own_plotter = plotter is None
+    if own_plotter:
+        plotter = Plotter()
+    # Run commands, one by one, as they are parsed, according to the appropriate function.
     try:
         for command in parsed:
-            COMMANDS[command["type"]](command, plotter)
+            COMMANDS[command.type](command, plotter)
         plotter.wait_till_idle()
     finally:
         plotter.stop()
+        if own_plotter:
+            plotter.close()
 
 
 
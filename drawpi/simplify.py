@@ -0,0 +1,91 @@
+'''Simplify polylines on the step grid, before they become pulses'''
+import numpy as np
+import drawpi.config as config
+from drawpi.point import Point, PointArray
+
+
+def _douglas_peucker(x, y, tolerance):
+    '''Mask of the points needed to keep the polyline within tolerance(in steps)'''
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        if dx == 0 and dy == 0:
+            distance = np.hypot(px, py)
+        else:
+            distance = np.abs(px * dy - py * dx) / np.hypot(dx, dy)
+        furthest = int(np.argmax(distance))
+        if distance[furthest] > tolerance:
+            split = first + 1 + furthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify_steps(x, y, tolerance=0):
+    '''Indices of the points(integer step coordinates) that are kept.
+
+    Repeated points and the middle of straight runs are always dropped, which
+    leaves the stepped path unchanged. With a tolerance(in steps) the rest is
+    simplified with Douglas-Peucker too.'''
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    if len(x) < 3:
+        return np.arange(len(x))
+    # Points less than a step from the last(same after rounding)
+    moved = np.ones(len(x), dtype=bool)
+    moved[1:] = (np.diff(x) != 0) | (np.diff(y) != 0)
+    kept = np.nonzero(moved)[0]
+    if len(kept) > 2:
+        dx = np.diff(x[kept])
+        dy = np.diff(y[kept])
+        # Corners, and points where the path doubles back on itself
+        turns = ((dx[:-1] * dy[1:] - dy[:-1] * dx[1:]) != 0) | ((dx[:-1] * dx[1:] + dy[:-1] * dy[1:]) < 0)
+        kept = kept[np.concatenate(([True], turns, [True]))]
+    if tolerance > 0 and len(kept) > 2:
+        kept = kept[_douglas_peucker(x[kept], y[kept], tolerance)]
+    return kept
+
+
+def simplify_stroke(stroke, tolerance=0):
+    '''Simplify a stroke(array of complex mm points), snapping it to steps'''
+    x = np.rint(stroke.real * config.STEPS_MM)
+    y = np.rint(stroke.imag * config.STEPS_MM)
+    kept = simplify_steps(x, y, tolerance)
+    return (x[kept] + 1j * y[kept]) / config.STEPS_MM
+
+
+def simplify_commands(commands, tolerance=0, position=Point(0, 0)):
+    '''Simplify runs of line commands(at one feedrate) in a stream of parsed commands'''
+    run = []
+    for command in commands:
+        if run and (command.type != "line" or command.feedrate != run[0].feedrate):
+            yield from _simplify_run(position, run, tolerance)
+            position = run[-1].finish
+            run = []
+        if command.type == "line":
+            run.append(command)
+        else:
+            if command.type == "goto":
+                position = command.finish
+            elif command.type == "zero":
+                position = Point(0, 0)
+            yield command
+    if run:
+        yield from _simplify_run(position, run, tolerance)
+
+
+def _simplify_run(start, run, tolerance):
+    points = PointArray.from_points([start] + [c.finish for c in run])
+    kept = simplify_steps(points.x, points.y, tolerance)
+    # The start point is not a command of the run
+    for i in kept[1:].tolist():
+        yield run[i - 1]
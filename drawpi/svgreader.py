@@ -1,68 +1,165 @@
 import xml.etree.ElementTree as ET
-from svg.path import parse_path, Path, Line, CubicBezier, QuadraticBezier, Arc
+from svg.path import parse_path, Path, CubicBezier, QuadraticBezier, Arc
 from svg.path.path import Move
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import itertools
+import logging
+import os
 import re
+import sys
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script(python drawpi/svgreader.py), so drawpi isn't on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drawpi import curves, transform, travel
+from drawpi.simplify import simplify_stroke
 
 OPTIONS_DEFAULT = {
     "detail": 0.1,
+    # Max distance(mm) a curve may stray from its straight line approximation.
+    # When set, curves are split into as few pieces as their curvature allows,
+    # instead of a piece every `detail` mm
+    "tolerance": None,
     "zero_before": True,
-    "zero_after": False
+    "zero_after": False,
+    # Reorder strokes to reduce pen up travel(see drawpi.travel)
+    "optimise_travel": False,
+    # Allow open strokes to be drawn backwards when reordering
+    "reverse_paths": True,
+    # Refine the reordering with 2-opt(slower)
+    "two_opt": False,
+    # Snap strokes to steps and simplify them, to within this many steps
+    # (0 only drops points that don't change the stepped path)
+    "simplify": None,
+    # Slice in this many worker processes(0 for one per core), or None for
+    # this process only. Small documents are always sliced in this process.
+    "workers": None
 }
 
+# Fewer shapes than this are sliced serially, whatever the workers option
+PARALLEL_MIN_SHAPES = 256
+# Shapes sent to a worker process at a time
+PARALLEL_CHUNK = 64
+
 VERBOSE = False
 
 class SVGParseException(Exception):
     pass
 
 class Shape:
-    def __init__(self, path:str, filled=False):
+    def __init__(self, path:str, filled=False, transform=None):
         if VERBOSE:
             print("Generating Path:", path)
-        self.path = parse_path(path)
+        # Path data, parsed when it is first needed(in a worker, when slicing in parallel)
+        self.d = path
+        self._path = None
         self.filled = filled
+        # Matrix taking the path's coordinates to mm(None if they already are)
+        self.transform = transform
+        # Approximate lengths of curved segments, by index
+        self._lengths = {}
     
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = parse_path(self.d)
+        return self._path
+
+    def __getstate__(self):
+        # Worker processes are only sent the path data, and parse it themselves
+        state = self.__dict__.copy()
+        state["_path"] = None
+        state["_lengths"] = {}
+        return state
+
     def get_raw(self):
         return self.path.d()
 
-    def slice(self, options):
-        '''Turns path into series of straight line moves and Pen ups and downs'''
-        instructions = ""
-        # We assume pen starts in up state
-        pen_state = False
-        for s in self.path:
+    def shapes(self):
+        '''The individual shapes to slice'''
+        yield self
+
+    def segment_length(self, index):
+        '''Approximate length of a segment of the path(cached, for repeat slicing)'''
+        try:
+            return self._lengths[index]
+        except KeyError:
+            length = self._lengths[index] = curves.length(self.path[index])
+            return length
+
+    def strokes(self, options):
+        '''Yield the path as strokes, arrays of complex points. Each is drawn(pen down)
+        from its first point, which is reached with the pen up, through the rest.'''
+        if self.transform is None:
+            yield from self._strokes(options)
+            return
+        # Sampling is done in the path's own units, detail and tolerance are in mm
+        scale = transform.scale_factor(self.transform)
+        if scale > 0:
+            options = dict(options, detail=options["detail"] / scale,
+                           tolerance=options["tolerance"] and options["tolerance"] / scale)
+        strokes = list(self._strokes(options))
+        if not strokes:
+            return
+        # Every point of the shape is transformed at once
+        points = transform.apply(self.transform, np.concatenate(strokes))
+        yield from np.split(points, np.cumsum([len(stroke) for stroke in strokes[:-1]]))
+
+    def _strokes(self, options):
+        stroke = None
+        for i, s in enumerate(self.path):
             if isinstance(s, Move):
-                # The move needs pen up
-                if pen_state:
-                    instructions += "PU\n"
-                    pen_state = False
-                instructions += "GT {} {}\n".format(s.start.real, s.start.imag)
-            else:
-                # Other units need pen down
-                if not pen_state:
-                    instructions += "PD\n"
-                    pen_state = True
-                if isinstance(s, Line):
-                    instructions += "LN {} {}\n".format(s.end.real, s.end.imag)
+                if stroke is not None:
+                    yield np.array(stroke)
+                stroke = [s.start]
+                continue
+            if stroke is None:
+                stroke = [s.start]
+            if isinstance(s, (CubicBezier, QuadraticBezier, Arc)):
+                # All the points of the curve are computed in bulk
+                if options["tolerance"]:
+                    curve = curves.flatten(s, options["tolerance"])
                 else:
-                    length = s.length(error=1e-5)
-                    if length <= options["detail"]:
-                        point = s.point(1)
-                        instructions += "LN {} {}\n".format(point.real, point.imag)
-                    else:
-                        step = options["detail"]/length
-                        steps = int(1/step)
-                        for x in range(steps):
-                            point = s.point(x*step)
-                            instructions += "LN {} {}\n".format(point.real, point.imag)
-        # Leave pen up(good manners)
-        if pen_state:
-            instructions += "PU\n"
-        return instructions
+                    curve = curves.sample(s, options["detail"], self.segment_length(i))
+                stroke.extend(curve.tolist())
+            else:
+                # Lines, and closing lines
+                stroke.append(s.end)
+        if stroke is not None:
+            yield np.array(stroke)
+
+    def iter_slice(self, options):
+        '''Lazily turns path into JCode lines(straight line moves and Pen ups and downs)'''
+        for stroke in self.strokes(options):
+            yield from stroke_commands(stroke)
+
+    def slice(self, options):
+        '''Turns path into series of straight line moves and Pen ups and downs'''
+        return "".join(self.iter_slice(options))
 
 
     def __str__(self):
         return "<Shape {}>".format(self.path.d())
 
+def stroke_commands(stroke):
+    '''JCode lines to draw a stroke(see Shape.strokes)'''
+    return stroke_text(stroke).splitlines(True)
+
+def stroke_text(stroke):
+    '''JCode to draw a stroke(see Shape.strokes), formatted in one go'''
+    coords = np.empty(2 * len(stroke))
+    coords[0::2] = stroke.real
+    coords[1::2] = stroke.imag
+    # A tenth of a micron is far finer than a step
+    template = "GT %.4f %.4f\n"
+    if len(stroke) > 1:
+        # Pen is left up after(good manners)
+        template += "PD\n" + "LN %.4f %.4f\n" * (len(stroke) - 1) + "PU\n"
+    return template % tuple(coords.tolist())
+
 class Group(Shape):
     def __init__(self, children:list):
         self.children = list(filter(lambda x: x is not None, children))
@@ -77,25 +174,83 @@ class Group(Shape):
                 uber_path += sh.get_raw()
         return uber_path
 
-    def slice(self, options):
-        instructions = ""
+    def strokes(self, options):
         for shape in self.children:
-            instructions += shape.slice(options)
-        return instructions
+            yield from shape.strokes(options)
+
+    def shapes(self):
+        for shape in self.children:
+            yield from shape.shapes()
     
     def __str__(self):
         return "<Group {}>".format(', '.join([str(x) for x in self.children]))
 
 class SVGRoot(Group):
-    def slice(self, options):
-        instructions = "PU\n"
+    def iter_slice(self, options):
+        yield "PU\n"
         if options["zero_before"]:
-            instructions += "ZE\n"
-        instructions += super().slice(options)
+            yield "ZE\n"
+        if options["optimise_travel"]:
+            # Needs every stroke before the first can be drawn
+            strokes = [stroke for chunk in _map_shapes(self.shapes(), options, False) for stroke in chunk]
+            strokes, _, _ = travel.optimise(strokes, reverse=options["reverse_paths"],
+                                            two_opt=options["two_opt"])
+            for stroke in strokes:
+                yield from stroke_commands(stroke)
+        else:
+            for text in _map_shapes(self.shapes(), options, True):
+                yield from text.splitlines(True)
         if options["zero_after"]:
-            instructions += "ZE\n"
-        return instructions
+            yield "ZE\n"
+
+def _slice_shapes(shapes, options, formatted):
+    '''Strokes of a list of shapes(simplified, if asked), or their JCode if formatted.
+    This is the work done by worker processes.'''
+    strokes = [stroke for shape in shapes for stroke in shape.strokes(options)]
+    if options["simplify"] is not None:
+        strokes = [simplify_stroke(stroke, options["simplify"]) for stroke in strokes]
+    if formatted:
+        return "".join([stroke_text(stroke) for stroke in strokes])
+    return strokes
+
+def _map_shapes(shapes, options, formatted):
+    '''_slice_shapes for every shape, yielding the results in order'''
+    shapes = iter(shapes)
+    workers = options["workers"]
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers is not None and workers > 1:
+        head = list(itertools.islice(shapes, PARALLEL_MIN_SHAPES))
+        if len(head) == PARALLEL_MIN_SHAPES:
+            yield from _map_parallel(itertools.chain(head, shapes), options, formatted, workers)
+            return
+        # Too small to be worth the processes
+        shapes = iter(head)
+    for shape in shapes:
+        yield _slice_shapes([shape], options, formatted)
 
+def _map_parallel(shapes, options, formatted, workers):
+    executor = ProcessPoolExecutor(workers)
+    try:
+        pending = deque()
+        while True:
+            chunk = list(itertools.islice(shapes, PARALLEL_CHUNK))
+            if chunk:
+                pending.append(executor.submit(_slice_shapes, chunk, options, formatted))
+            # A couple of chunks are kept queued per worker, so none sit idle
+            while pending and (not chunk or len(pending) >= 2 * workers):
+                yield pending.popleft().result()
+            if not chunk:
+                break
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+class SVGStream(SVGRoot):
+    '''An SVGRoot whose shapes are read from the file as they are sliced(see parse_stream).
+    Its shapes can only be gone through once.'''
+    def __init__(self, shapes):
+        self.children = shapes
+        self.filled = False
 
 
 def getEllipsePath(cx, cy, rx, ry):
@@ -122,31 +277,83 @@ def parse(doc):
         print(root.tag)
         raise SVGParseException("Missing <svg> tag")
     paths = []
+    root_transform = _viewport(root)
     for c in root:
-        paths.append(getPath(c))
+        paths.append(getPath(c, root_transform))
     return SVGRoot(paths)
 
 
-def getPath(elem):
-    if elem.tag == "circle":
+def local_tag(tag):
+    '''Tag name without its namespace'''
+    return tag.rsplit("}", 1)[-1]
+
+# Elements drawn as a single shape
+SHAPE_TAGS = {"circle", "ellipse", "line", "polygon", "polyline", "rect", "path"}
+
+def parse_stream(source):
+    '''Read an SVG file(name or file object) incrementally. Shapes are parsed as they
+    are sliced, and their elements thrown away, so the whole document never has to be
+    in memory.'''
+    return SVGStream(_iter_shapes(ET.iterparse(source, events=("start", "end"))))
+
+def _iter_shapes(events):
+    # Open elements, whether the shapes inside each are drawn(only in the root and groups)
+    # and the transform to mm inside each
+    stack = []
+    for event, elem in events:
+        tag = local_tag(elem.tag)
+        if event == "start":
+            if not stack:
+                if tag != "svg":
+                    raise SVGParseException("Missing <svg> tag")
+                stack.append((elem, True, _viewport(elem)))
+            elif tag == "g":
+                stack.append((elem, stack[-1][1], _compose(stack[-1][2], elem)))
+            else:
+                stack.append((elem, False, None))
+            continue
+        stack.pop()
+        if stack and stack[-1][1] and tag in SHAPE_TAGS:
+            yield getPath(elem, stack[-1][2])
+        if stack:
+            # Everything inside the parent so far has now been dealt with
+            del stack[-1][0][:]
+
+def _viewport(root):
+    '''Transform to mm for the contents of the <svg> element(None if not needed)'''
+    m = transform.viewport(root.attrib)
+    return None if transform.is_identity(m) else m
+
+def _compose(parent, elem):
+    '''Transform to mm for the contents of elem, inside parent's transform'''
+    own = elem.attrib.get("transform")
+    if own is None:
+        return parent
+    own = transform.parse_transform(own)
+    return own if parent is None else parent @ own
+
+def getPath(elem, parent_transform=None):
+    tag = local_tag(elem.tag)
+    shape_transform = _compose(parent_transform, elem)
+    if tag == "circle":
         x = float(elem.attrib["cx"])
         y = float(elem.attrib["cy"])
         r = float(elem.attrib["r"])
-        return Shape(getEllipsePath(x, y, r, r))
-    elif elem.tag == "ellipse":
+        return Shape(getEllipsePath(x, y, r, r), transform=shape_transform)
+    elif tag == "ellipse":
         x = float(elem.attrib["cx"])
         y = float(elem.attrib["cy"])
         rx = float(elem.attrib["rx"])
         ry = float(elem.attrib["ry"])
-        return Shape(getEllipsePath(x, y, rx, ry))
-    elif elem.tag == "line":
+        return Shape(getEllipsePath(x, y, rx, ry), transform=shape_transform)
+    elif tag == "line":
         x = float(elem.attrib["x1"])
         y = float(elem.attrib["y1"])
         ex = float(elem.attrib["x2"])
         ey = float(elem.attrib["y2"])
-        return Shape(getLinePath(x, y, ex, ey))
-    elif elem.tag == "polygon" or elem.tag == "polyline":
-        closed = elem.tag == "polygon"
+        return Shape(getLinePath(x, y, ex, ey), transform=shape_transform)
+    elif tag == "polygon" or tag == "polyline":
+        closed = tag == "polygon"
         coordlist = elem.attrib["points"]
         # Parse list of coords
         coordlist = coordlist.replace('e-', 'NEGEXP').replace('E-', 'NEGEXP')
@@ -155,27 +362,31 @@ def getPath(elem):
         coordlist = coordlist.replace('NEGEXP', 'e-')
         coordlist = [float(x) for x in coordlist.split()]
         tupled_list = [(coordlist[i], coordlist[i+1]) for i in range(0, len(coordlist), 2)]
-        return Shape(getLinesPath(tupled_list[0], *tupled_list[1:], closed=closed))
-    elif elem.tag == "rect":
+        return Shape(getLinesPath(tupled_list[0], *tupled_list[1:], closed=closed), transform=shape_transform)
+    elif tag == "rect":
         x = float(elem.attrib["x"])
         y = float(elem.attrib["y"])
         ex = x + float(elem.attrib["width"])
         ey = y + float(elem.attrib["height"])
-        return Shape(getLinesPath((x, y), (ex, y), (ex, ey), (x, ey), closed=True))
-    elif elem.tag == "path":
-        return Shape(elem.attrib["d"])
-    elif elem.tag == "g":
+        return Shape(getLinesPath((x, y), (ex, y), (ex, ey), (x, ey), closed=True), transform=shape_transform)
+    elif tag == "path":
+        return Shape(elem.attrib["d"], transform=shape_transform)
+    elif tag == "g":
         # Return list of elements
-        return Group([getPath(x) for x in elem])
+        return Group([getPath(x, shape_transform) for x in elem])
     else:
         if VERBOSE:
-            print("Dont understand {}".format(elem.tag))
+            print("Dont understand {}".format(tag))
         return None
 
-def slice(parsed_doc, spec_options = {}):
+def iter_slice(parsed_doc, spec_options = {}):
+    '''Generator of JCode lines, produced shape by shape as they are sliced'''
     options = OPTIONS_DEFAULT.copy()
     options.update(spec_options)
-    return parsed_doc.slice(options)
+    return parsed_doc.iter_slice(options)
+
+def slice(parsed_doc, spec_options = {}):
+    return "".join(iter_slice(parsed_doc, spec_options))
 
 if __name__ == "__main__":
     import argparse
@@ -184,14 +395,28 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("input", help="the input file")
     parser.add_argument("-o", "--output", help="Output File")
+    parser.add_argument("-t", "--tolerance", type=float, help="Flatten curves adaptively, to within this many mm")
+    parser.add_argument("--optimise", action="store_true", help="Reorder strokes to reduce pen up travel")
+    parser.add_argument("--two-opt", action="store_true", help="Refine the reordering with 2-opt")
+    parser.add_argument("--no-reverse", action="store_true", help="Don't draw strokes backwards when reordering")
+    parser.add_argument("--simplify", type=float, help="Simplify strokes on the step grid, to within this many steps")
+    parser.add_argument("-j", "--jobs", type=int, help="Slice in this many processes(0 for one per core)")
     args = parser.parse_args()
     VERBOSE = args.verbose
-    with open(args.input, 'r') as f:
-        text = f.read()
-    
-    result = slice(parse(text))
+    # Travel report goes to stderr
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    result = iter_slice(parse_stream(args.input), {
+        "tolerance": args.tolerance,
+        "optimise_travel": args.optimise or args.two_opt,
+        "reverse_paths": not args.no_reverse,
+        "two_opt": args.two_opt,
+        "simplify": args.simplify,
+        "workers": args.jobs
+    })
     if args.output:
         with open(args.output, 'w') as f:
-            f.write(result)
+            f.writelines(result)
     else:
-        print(result)
+        for line in result:
+            sys.stdout.write(line)
@@ -0,0 +1,103 @@
+'''SVG transforms, as 3x3 affine matrices applied to arrays of complex points'''
+import math
+import re
+import numpy as np
+
+IDENTITY = np.identity(3)
+
+# Millimetres per unit. Plain numbers are taken as mm, as they always have been.
+UNITS = {
+    "": 1.0,
+    "mm": 1.0,
+    "cm": 10.0,
+    "in": 25.4,
+    "pt": 25.4 / 72,
+    "pc": 25.4 / 6,
+    "px": 25.4 / 96
+}
+
+_TRANSFORM_RE = re.compile(r"(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)")
+_LENGTH_RE = re.compile(r"^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([a-z]*)\s*$")
+
+
+def matrix(a, b, c, d, e, f):
+    '''The matrix of SVG's matrix(a b c d e f)'''
+    return np.array([[a, c, e], [b, d, f], [0, 0, 1]], dtype=np.float64)
+
+
+def parse_transform(text):
+    '''Matrix for the value of a transform attribute(None gives the identity)'''
+    result = IDENTITY
+    if not text:
+        return result
+    for name, args in _TRANSFORM_RE.findall(text):
+        values = [float(x) for x in args.replace(",", " ").split()]
+        if name == "matrix":
+            m = matrix(*values)
+        elif name == "translate":
+            m = matrix(1, 0, 0, 1, values[0], values[1] if len(values) > 1 else 0)
+        elif name == "scale":
+            m = matrix(values[0], 0, 0, values[1] if len(values) > 1 else values[0], 0, 0)
+        elif name == "rotate":
+            angle = math.radians(values[0])
+            cos, sin = math.cos(angle), math.sin(angle)
+            m = matrix(cos, sin, -sin, cos, 0, 0)
+            if len(values) == 3:
+                # Rotate about (cx, cy)
+                cx, cy = values[1], values[2]
+                m = matrix(1, 0, 0, 1, cx, cy) @ m @ matrix(1, 0, 0, 1, -cx, -cy)
+        elif name == "skewX":
+            m = matrix(1, 0, math.tan(math.radians(values[0])), 1, 0, 0)
+        else:
+            m = matrix(1, math.tan(math.radians(values[0])), 0, 1, 0, 0)
+        # Transforms in a list apply right to left
+        result = result @ m
+    return result
+
+
+def parse_length(text):
+    '''A length attribute in mm, or None if it is missing or relative(%, em...)'''
+    if text is None:
+        return None
+    match = _LENGTH_RE.match(text)
+    if match is None or match.group(2) not in UNITS:
+        return None
+    return float(match.group(1)) * UNITS[match.group(2)]
+
+
+def viewport(attrib):
+    '''Matrix taking user units of an <svg> element, with these attributes, to mm'''
+    viewbox = attrib.get("viewBox")
+    if viewbox is None:
+        # No viewBox, user units are taken as mm
+        return IDENTITY
+    min_x, min_y, width, height = [float(x) for x in viewbox.replace(",", " ").split()]
+    if width <= 0 or height <= 0:
+        return IDENTITY
+    target_width = parse_length(attrib.get("width")) or width
+    target_height = parse_length(attrib.get("height")) or height
+    scale_x = target_width / width
+    scale_y = target_height / height
+    if attrib.get("preserveAspectRatio", "").split()[:1] == ["none"]:
+        return matrix(scale_x, 0, 0, scale_y, -min_x * scale_x, -min_y * scale_y)
+    # Default(xMidYMid meet), uniform scale and centred
+    scale = min(scale_x, scale_y)
+    return matrix(scale, 0, 0, scale,
+                  (target_width - width * scale) / 2 - min_x * scale,
+                  (target_height - height * scale) / 2 - min_y * scale)
+
+
+def is_identity(m):
+    return m is IDENTITY or np.array_equal(m, IDENTITY)
+
+
+def scale_factor(m):
+    '''Average scaling of lengths by the matrix'''
+    return math.sqrt(abs(np.linalg.det(m[:2, :2])))
+
+
+def apply(m, points):
+    '''Transform an array of complex points'''
+    xy = np.stack((points.real, points.imag))
+    out = m[:2, :2] @ xy + m[:2, 2:]
+    return out[0] + 1j * out[1]
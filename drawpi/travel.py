@@ -0,0 +1,170 @@
+'''Reorder strokes to cut down on pen up travel between them'''
+import logging
+import math
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# How many strokes ahead 2-opt looks for a better reversal
+TWO_OPT_WINDOW = 50
+# Max improvement passes made by 2-opt
+TWO_OPT_PASSES = 4
+
+
+def travel_distance(strokes, start=0j):
+    '''Total pen up distance, from start, to draw strokes in the given order'''
+    if not len(strokes):
+        return 0.0
+    entries = np.array([stroke[0] for stroke in strokes])
+    exits = np.array([start] + [stroke[-1] for stroke in strokes[:-1]])
+    return float(np.abs(entries - exits).sum())
+
+
+class _Grid:
+    '''Uniform grid of points, for nearest neighbour queries as points are used up.
+    Coincident points(strokes starting at the same place) are looked at only once.'''
+
+    def __init__(self, points, cell):
+        self.points = points.tolist()
+        self.cell = cell
+        # Cell -> point -> indices of the points there(a dict, in order, so any can
+        # be removed at once)
+        self.cells = {}
+        self.remaining = len(points)
+        for i, p in enumerate(self.points):
+            self.cells.setdefault(self._key(p), {}).setdefault(p, {})[i] = None
+
+    def _key(self, p):
+        return (math.floor(p.real / self.cell), math.floor(p.imag / self.cell))
+
+    def remove(self, i):
+        p = self.points[i]
+        key = self._key(p)
+        bucket = self.cells[key]
+        del bucket[p][i]
+        if not bucket[p]:
+            del bucket[p]
+            if not bucket:
+                del self.cells[key]
+        self.remaining -= 1
+
+    def nearest(self, p):
+        '''Index of the remaining point nearest to p'''
+        cx, cy = self._key(p)
+        best = None
+        best_distance = math.inf
+        ring = 0
+        while True:
+            # Square rings of cells around p's cell
+            if ring == 0:
+                keys = [(cx, cy)]
+            else:
+                keys = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+                keys += [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+            for key in keys:
+                for point in self.cells.get(key, ()):
+                    distance = abs(point - p)
+                    if distance < best_distance:
+                        best, best_distance = point, distance
+            # Anything beyond this ring is at least this far away
+            if best is not None and best_distance <= ring * self.cell:
+                break
+            ring += 1
+            if (2 * ring + 1) ** 2 > 4 * len(self.cells):
+                # Mostly empty space around p, quicker to check every cell
+                for bucket in self.cells.values():
+                    for point in bucket:
+                        distance = abs(point - p)
+                        if distance < best_distance:
+                            best, best_distance = point, distance
+                break
+        return next(reversed(self.cells[self._key(best)][best]))
+
+
+def _nearest_neighbour(strokes, reverse, start):
+    '''Greedy ordering, always drawing the stroke with the nearest end next.
+    Returns the order, and whether each is drawn reversed.'''
+    count = len(strokes)
+    starts = np.array([stroke[0] for stroke in strokes])
+    ends = np.array([stroke[-1] for stroke in strokes])
+    # Entry points, the first `count` draw forwards, the rest backwards
+    reversible = np.nonzero(ends != starts)[0] if reverse else np.zeros(0, dtype=int)
+    entries = np.concatenate((starts, ends[reversible]))
+    owner = np.concatenate((np.arange(count), reversible))
+    # About two entry points per cell
+    low = complex(entries.real.min(), entries.imag.min())
+    high = complex(entries.real.max(), entries.imag.max())
+    cell = max(math.sqrt((high.real - low.real) * (high.imag - low.imag) / len(entries) * 2), 1e-3)
+    grid = _Grid(entries, cell)
+    # Other entry point of each reversible stroke
+    partner = {}
+    for n, i in enumerate(reversible.tolist()):
+        partner[i] = count + n
+        partner[count + n] = i
+
+    order = []
+    flipped = []
+    position = start
+    while grid.remaining:
+        entry = grid.nearest(position)
+        grid.remove(entry)
+        if entry in partner:
+            grid.remove(partner[entry])
+        stroke = int(owner[entry])
+        is_flipped = entry >= count
+        order.append(stroke)
+        flipped.append(is_flipped)
+        position = complex(starts[stroke] if is_flipped else ends[stroke])
+    return order, flipped
+
+
+def _two_opt(entries, exits, start):
+    '''Improve a route by reversing runs of strokes, when that shortens the travel
+    either side of the run. Works in place on the entry/exit points(one per stroke,
+    in drawing order) and returns the (start, end) slices that were reversed, in turn.'''
+    count = len(entries)
+    reversals = []
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        for i in range(count - 1):
+            before = exits[i - 1] if i else start
+            j = np.arange(i + 1, min(count, i + TWO_OPT_WINDOW))
+            # Travel after each candidate run(none after the final stroke)
+            has_next = j + 1 < count
+            following = entries[np.minimum(j + 1, count - 1)]
+            old = abs(before - entries[i]) + np.where(has_next, np.abs(exits[j] - following), 0)
+            new = np.abs(before - exits[j]) + np.where(has_next, np.abs(entries[i] - following), 0)
+            gain = old - new
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                end = int(j[best]) + 1
+                # Reversing the run swaps each stroke's entry and exit too
+                entries[i:end], exits[i:end] = exits[i:end][::-1].copy(), entries[i:end][::-1].copy()
+                reversals.append((i, end))
+                improved = True
+        if not improved:
+            break
+    return reversals
+
+
+def optimise(strokes, reverse=True, two_opt=False, start=0j):
+    '''Reorder strokes(arrays of complex points, drawn from the first) to reduce pen up
+    travel, starting at start. Open strokes may be drawn backwards if reverse is set.
+    Returns the reordered strokes, and the travel distance before and after.'''
+    strokes = list(strokes)
+    before = travel_distance(strokes, start)
+    if len(strokes) < 2:
+        return strokes, before, before
+    order, flipped = _nearest_neighbour(strokes, reverse, start)
+    ordered = [strokes[i][::-1] if f else strokes[i] for i, f in zip(order, flipped)]
+    if two_opt and not reverse:
+        logger.info("2-opt reverses runs of strokes, so was skipped as strokes can't be reversed")
+    elif two_opt:
+        entries = np.array([stroke[0] for stroke in ordered])
+        exits = np.array([stroke[-1] for stroke in ordered])
+        for i, end in _two_opt(entries, exits, start):
+            ordered[i:end] = [stroke[::-1] for stroke in reversed(ordered[i:end])]
+    after = travel_distance(ordered, start)
+    logger.info("Pen up travel reduced from {:.1f}mm to {:.1f}mm over {} strokes".format(
+        before, after, len(ordered)))
+    return ordered, before, after
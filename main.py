@@ -11,24 +11,97 @@ if __name__ == "__main__":
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-s", "--svg", help="An SVG file to draw")
     group.add_argument("-f", "--file", help="A raw command file to draw")
+    group.add_argument("-b", "--binary", help="A binary command file to draw")
+    group.add_argument("-p", "--play", help="A compiled pulse image to draw")
     group.add_argument("-w", "--web", help="Launch the web interface", action="store_true")
+    parser.add_argument("-o", "--output", help="Write the commands to this file rather than drawing them(binary for -s and -f, text for -b)")
+    parser.add_argument("-t", "--tolerance", type=float, help="Flatten the SVG's curves adaptively, to within this many mm")
+    parser.add_argument("--optimise", action="store_true", help="Reorder the SVG's strokes to reduce pen up travel")
+    parser.add_argument("--two-opt", action="store_true", help="Refine the reordering with 2-opt(implies --optimise)")
+    parser.add_argument("--no-reverse", action="store_true", help="Don't draw strokes backwards when reordering")
+    parser.add_argument("--simplify", type=float, help="Simplify lines on the step grid, to within this many steps(0 is lossless)")
+    parser.add_argument("-j", "--jobs", type=int, help="Slice in this many processes(0 for one per core)")
+    parser.add_argument("--no-cache", action="store_true", help="Always slice the SVG, rather than using cached JCode")
+    parser.add_argument("--plan", action="store_true", help="Plan acceleration, looking ahead through lines(faster travel and lines)")
+    parser.add_argument("--compile", help="Compile the job's pulses to this image, for --play, rather than drawing it")
+    parser.add_argument("--dry-run", action="store_true", help="Run the job on a simulated plotter, and report the time, pulses and DMA memory it needs")
 
     args = parser.parse_args()
     # Check whether file is specified.
-    if args.svg or args.file:
-        from drawpi.svgreader import parse, slice
-        from drawpi.runner import main, setup_logging
+    if args.svg or args.file or args.binary:
+        from drawpi.svgreader import parse_stream, iter_slice
+        from drawpi.decode import PlotterParser
+        from drawpi.runner import prepare, run, setup_logging
+        import drawpi.binary
         # Setup the logger
         setup_logging(args.verbose)
         logger = logging.getLogger()
-        if args.svg:
-            with open(args.svg, 'r') as f:
-                text = f.read()
-            commands = slice(parse(text))
+        if args.compile:
+            from drawpi.hardware.pulses import compile_image
+
+            def draw(parsed, simplify=None, plan=False):
+                with open(args.compile, 'wb') as out:
+                    count = compile_image(prepare(parsed, simplify, plan), out)
+                logger.info("Compiled {} pulse records".format(count))
+        elif args.dry_run:
+            from drawpi.hardware.simulator import simulate, log_report
+
+            def draw(parsed, simplify=None, plan=False):
+                log_report(simulate(parsed, simplify, plan))
         else:
+            draw = run
+        if args.svg:
+            options = {
+                "tolerance": args.tolerance,
+                "optimise_travel": args.optimise or args.two_opt,
+                "reverse_paths": not args.no_reverse,
+                "two_opt": args.two_opt,
+                "simplify": args.simplify,
+                "workers": args.jobs
+            }
+            # Read and sliced lazily, drawing starts with the first shape
+            commands = iter_slice(parse_stream(args.svg), options)
+            if not args.no_cache:
+                from drawpi.cache import cache_key, default_cache
+                cache = default_cache()
+                with open(args.svg, 'rb') as f:
+                    key = cache_key(f, options)
+                cached = cache.get(key)
+                if cached is not None:
+                    logger.info("Using cached JCode")
+                    commands = cached
+                else:
+                    # Stored once it has all been drawn
+                    commands = cache.stream(key, commands)
+            if args.output:
+                with open(args.output, 'wb') as out:
+                    drawpi.binary.from_text(commands, out)
+            else:
+                draw(PlotterParser(commands), plan=args.plan)
+        elif args.file:
             with open(args.file, 'r') as f:
-                commands = f.read()
-        main(commands)
+                if args.output:
+                    with open(args.output, 'wb') as out:
+                        drawpi.binary.from_text(f, out)
+                else:
+                    draw(PlotterParser(f), simplify=args.simplify, plan=args.plan)
+        else:
+            with drawpi.binary.load(args.binary) as commands:
+                if args.output:
+                    with open(args.output, 'w') as out:
+                        out.writelines(drawpi.binary.to_text(commands))
+                else:
+                    draw(commands, simplify=args.simplify, plan=args.plan)
+    elif args.play:
+        from drawpi.hardware import pulses
+        from drawpi.runner import setup_logging
+        setup_logging(args.verbose)
+        with pulses.load(args.play) as image:
+            if args.dry_run:
+                from drawpi.hardware.simulator import simulate_image, log_report
+                log_report(simulate_image(image))
+            else:
+                pulses.play(image)
     elif args.web:
         # Server time
         import webserver
@@ -1,9 +1,11 @@
-from flask import Flask, render_template, send_file
+from flask import Flask, render_template, request, send_file
 from flask_socketio import SocketIO, emit
-from drawpi.svgreader import slice, parse
+from drawpi.cache import cached_slice, default_cache
 from threading import Thread
 import logging
 from drawpi.runner import main
+from drawpi.hardware.simulator import UPPER_BOUNDS, dry_run
+from drawpi.hardware.pulsecache import default_pulse_cache
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'TopSecretMagic'
@@ -40,7 +42,28 @@ def index():
 
 @socketio.on("SVGLoad")
 def load_svg(text):
-    emit("SVGProcessed", slice(parse(text)))
+    emit("SVGProcessed", cached_slice(text))
+
+@socketio.on("CacheStats")
+def cache_stats():
+    emit("CacheStats", default_cache().stats())
+
+@socketio.on("PulseCacheStats")
+def pulse_cache_stats():
+    emit("PulseCacheStats", default_pulse_cache().stats())
+
+@socketio.on("DryRun")
+def dry_run_commands(commands):
+    # Simulating a big job takes a while, so it isn't done in the handler
+    socketio.start_background_task(send_dry_run, commands, request.sid)
+
+def send_dry_run(commands, sid):
+    try:
+        # Which of the entries are only upper bounds
+        socketio.emit("DryRunReport", dict(dry_run(commands), upper_bounds=list(UPPER_BOUNDS)), room=sid)
+    except Exception as e:
+        logging.error(str(e))
+        socketio.emit("StatusUpdate", {"error": True, "text":"The dry run errored: "+ str(e)}, room=sid)
 
 @socketio.on("RunCommands")
 def run_commands(commands):